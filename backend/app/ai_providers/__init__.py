@@ -3,11 +3,13 @@ from .openai_provider import OpenAIProvider
 from .anthropic_provider import AnthropicProvider
 from .google_provider import GoogleProvider
 from .manager import AIProviderManager
+from .cache import RedisLLMCache
 
 __all__ = [
     "AIProvider",
     "OpenAIProvider", 
     "AnthropicProvider",
     "GoogleProvider",
-    "AIProviderManager"
+    "AIProviderManager",
+    "RedisLLMCache"
 ]
\ No newline at end of file
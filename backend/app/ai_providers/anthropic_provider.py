@@ -1,12 +1,21 @@
 import anthropic
-from typing import List, Dict
-from .base import AIProvider, SummaryResult
+import httpx
+import asyncio
+from typing import List, Dict, Optional, Tuple
+from .base import AIProvider, SummaryResult, count_tokens, TEMPERATURE, MAX_OUTPUT_TOKENS
+from .cache import RedisLLMCache
 from ..config import settings
 
 class AnthropicProvider(AIProvider):
-    def __init__(self, api_key: str, model_name: str = "claude-3-sonnet-20240229"):
-        super().__init__(api_key, model_name)
-        self.client = anthropic.AsyncAnthropic(api_key=api_key) if api_key else None
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str = "claude-3-sonnet-20240229",
+        http_client: Optional[httpx.AsyncClient] = None,
+        cache: Optional[RedisLLMCache] = None
+    ):
+        super().__init__(api_key, model_name, settings.ai_max_concurrency, cache)
+        self.client = anthropic.AsyncAnthropic(api_key=api_key, http_client=http_client) if api_key else None
         self.input_cost_per_1k = settings.anthropic_claude_input_cost
         self.output_cost_per_1k = settings.anthropic_claude_output_cost
     
@@ -15,50 +24,15 @@ class AnthropicProvider(AIProvider):
             raise ValueError("Anthropic API key not configured")
         
         try:
-            prompt = f"""Please provide a comprehensive summary of the following document in approximately {max_length} words.
-            Also extract:
-            1. Key points (as bullet points)
-            2. Important entities (people, organizations, dates, etc.)
-            
-            Document:
-            {text[:8000]}  # Limit input
-            
-            Format your response as:
-            SUMMARY:
-            [Your summary here]
-            
-            KEY POINTS:
-            • [Point 1]
-            • [Point 2]
-            • [Point 3]
-            
-            ENTITIES:
-            - [Entity 1: Type]
-            - [Entity 2: Type]
-            """
-            
-            response = await self.client.messages.create(
-                model=self.model_name,
-                max_tokens=1000,
-                temperature=0.3,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
+            # Entity extraction only needs the source text, so overlap it with the LLM call
+            (content, input_tokens, output_tokens, truncated), entities = await asyncio.gather(
+                self._map_reduce(text, max_length),
+                asyncio.to_thread(self.extract_entities, text)
             )
             
-            content = response.content[0].text
-            
             # Parse response
-            summary = ""
-            if "SUMMARY:" in content:
-                summary = content.split("SUMMARY:")[1].split("KEY POINTS:")[0].strip()
-            
-            key_points = self.extract_key_points(content)
-            entities = self.extract_entities(text)
+            summary, key_points = self.parse_response(content)
             
-            # Estimate tokens (Anthropic doesn't provide exact usage)
-            input_tokens = self.estimate_tokens(text)
-            output_tokens = self.estimate_tokens(content)
             total_tokens = input_tokens + output_tokens
             cost = self.estimate_cost(input_tokens, output_tokens)
             
@@ -68,15 +42,90 @@ class AnthropicProvider(AIProvider):
                 entities=entities,
                 tokens_used=total_tokens,
                 cost=cost,
-                provider_used=f"Anthropic/{self.model_name}"
+                provider_used=f"Anthropic/{self.model_name}",
+                truncated=truncated
             )
             
         except Exception as e:
             raise Exception(f"Anthropic summarization failed: {str(e)}")
     
+    async def _complete(self, instructions: str, text: str) -> Tuple[str, int, int]:
+        async with self.client.messages.stream(
+            model=self.model_name,
+            max_tokens=MAX_OUTPUT_TOKENS,
+            temperature=TEMPERATURE,
+            # Static instructions first, marked as a cacheable prefix
+            system=[
+                {"type": "text", "text": instructions, "cache_control": {"type": "ephemeral"}}
+            ],
+            messages=[
+                {"role": "user", "content": text}
+            ]
+        ) as stream:
+            content = await self._collect_stream(stream.text_stream, instructions)
+            message = await stream.get_final_message()
+        
+        usage = message.usage
+        # input_tokens excludes the prefix tokens written to or read from the prompt cache
+        input_tokens = (
+            usage.input_tokens
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+            + (getattr(usage, "cache_read_input_tokens", None) or 0)
+        )
+        return content, input_tokens, usage.output_tokens
+    
+    async def submit_batch(self, docs: List[Tuple[str, int]], max_length: int = 500, final: bool = False) -> str:
+        """Queue (text, job_id) pairs on the Message Batches API and return the batch id"""
+        if not self.client:
+            raise ValueError("Anthropic API key not configured")
+        
+        batch = await self.client.beta.messages.batches.create(requests=[
+            {
+                "custom_id": custom_id,
+                "params": {
+                    "model": self.model_name,
+                    "max_tokens": MAX_OUTPUT_TOKENS,
+                    "temperature": TEMPERATURE,
+                    "system": [
+                        {"type": "text", "text": instructions, "cache_control": {"type": "ephemeral"}}
+                    ],
+                    "messages": [
+                        {"role": "user", "content": content}
+                    ]
+                }
+            }
+            for custom_id, instructions, content in self._batch_requests(docs, max_length, final)
+        ])
+        return batch.id
+    
+    async def fetch_batch(self, batch_id: str) -> Tuple[str, Dict[str, Tuple[str, int, int]]]:
+        """Return the batch status and, once ended, {custom_id: (content, input_tokens, output_tokens)}
+        
+        "ended" is reported as "completed" to match the OpenAI batch statuses.
+        """
+        batch = await self.client.beta.messages.batches.retrieve(batch_id)
+        if batch.processing_status != "ended":
+            return batch.processing_status, {}
+        
+        results = {}
+        async for entry in await self.client.beta.messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                continue
+            message = entry.result.message
+            usage = message.usage
+            results[entry.custom_id] = (
+                "".join(block.text for block in message.content if block.type == "text"),
+                usage.input_tokens
+                + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+                + (getattr(usage, "cache_read_input_tokens", None) or 0),
+                usage.output_tokens
+            )
+        
+        return "completed", results
+    
     def estimate_tokens(self, text: str) -> int:
-        # Rough estimation for Claude
-        return len(text) // 4
+        # cl100k approximation for Claude
+        return count_tokens(text)
     
     def is_available(self) -> bool:
         return self.client is not None
\ No newline at end of file
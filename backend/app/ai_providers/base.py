@@ -1,6 +1,89 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from contextvars import ContextVar
 from dataclasses import dataclass
+import asyncio
+import itertools
+import re
+import tiktoken
+from ..config import settings
+
+MAX_ENTITIES = 10
+MAX_KEY_POINTS = 5
+
+# One bullet ("•", "-" or "*" followed by whitespace) per line
+_BULLET_RE = re.compile(r'^[ \t]*[•\-\*][ \t]+(.+?)[ \t\r]*$', re.MULTILINE)
+
+# Sampling parameters shared by every provider (also part of the cache key)
+TEMPERATURE = 0.3
+MAX_OUTPUT_TOKENS = 1000
+
+# Part of the summary cache key; bump when the prompts or response parsing change
+PROMPT_VERSION = 1
+
+# Partial summaries are reduced in rounds until they fit this many tokens in one
+# request, leaving room for the instructions and output in an 8k context
+REDUCE_TOKEN_BUDGET = 6000
+MAX_REDUCE_ROUNDS = 3
+
+# Batch API requests are billed at half the synchronous price
+BATCH_DISCOUNT = 0.5
+
+# A streamed summary must show its SUMMARY: section within this many characters
+SUMMARY_MARKER_WINDOW = 500
+
+# SUMMARY / KEY POINTS / ENTITIES response sections, parsed in one pass
+_RESPONSE_RE = re.compile(
+    r'SUMMARY:\s*(?P<summary>.*?)\s*'
+    r'(?:KEY POINTS:\s*(?P<key_points>.*?)\s*)?'
+    r'(?:ENTITIES:\s*(?P<entities>.*))?$',
+    re.DOTALL
+)
+
+# Entity patterns, scanned one type at a time in this order. A single alternation
+# would drop matches that overlap another type's (a date or email inside a URL)
+_ENTITY_PATTERNS = (
+    ("email", re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')),
+    ("url", re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')),
+    ("date", re.compile(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b')),
+    ("money", re.compile(r'\$[\d,]+\.?\d*')),
+)
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """Count tokens with tiktoken (not memoized: a cache keyed on the text would pin whole documents)"""
+    try:
+        encoding = tiktoken.get_encoding(encoding_name)
+        return len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        # Fallback estimation: ~4 chars per token
+        return len(text) // 4
+
+# Prompts are static instruction prefixes; the document text is always sent
+# last, in its own message, so provider-side prompt caching can reuse the prefix
+SUMMARY_INSTRUCTIONS = """You are a helpful document summarization assistant.
+Please provide a comprehensive summary of the document in the user message in approximately {max_length} words.
+Also extract:
+1. Key points (as bullet points)
+2. Important entities (people, organizations, dates, etc.)
+
+Format your response as:
+SUMMARY:
+[Your summary here]
+
+KEY POINTS:
+• [Point 1]
+• [Point 2]
+• [Point 3]
+
+ENTITIES:
+- [Entity 1: Type]
+- [Entity 2: Type]
+"""
+
+CHUNK_INSTRUCTIONS = """You are a helpful document summarization assistant.
+The user message is one section of a longer document. Summarize the section concisely,
+keeping every fact, figure, name and date that may matter for a summary of the whole document.
+"""
 
 @dataclass
 class SummaryResult:
@@ -10,18 +93,187 @@ class SummaryResult:
     tokens_used: int
     cost: float
     provider_used: str
+    cached: bool = False  # served from the summary cache
+    truncated: bool = False  # only the first ai_max_map_chunks chunks were summarized
+
+@dataclass
+class UsageMeter:
+    """Tokens billed by every request made under one metered() call"""
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+_usage_meter: ContextVar[Optional[UsageMeter]] = ContextVar("usage_meter", default=None)
+
+async def metered(coro, meter: UsageMeter):
+    """Await coro with its provider requests, including chunk tasks it spawns, counted on meter"""
+    _usage_meter.set(meter)
+    return await coro
+
+def _record_usage(input_tokens: int, output_tokens: int):
+    meter = _usage_meter.get()
+    if meter is not None:
+        meter.input_tokens += input_tokens
+        meter.output_tokens += output_tokens
 
 class AIProvider(ABC):
-    def __init__(self, api_key: str, model_name: str):
+    def __init__(self, api_key: str, model_name: str, max_concurrency: int = 4, cache=None):
         self.api_key = api_key
         self.model_name = model_name
         self.input_cost_per_1k = 0.0
         self.output_cost_per_1k = 0.0
+        # Caps in-flight requests to this provider across all chunks
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Optional RedisLLMCache for raw completions
+        self.cache = cache
     
     @abstractmethod
     async def summarize(self, text: str, max_length: int = 500) -> SummaryResult:
         pass
     
+    @abstractmethod
+    async def _complete(self, instructions: str, text: str) -> Tuple[str, int, int]:
+        """Send static instructions followed by text; return (content, input_tokens, output_tokens)"""
+        pass
+    
+    async def _collect_stream(self, deltas: AsyncIterator[str], instructions: str) -> str:
+        """Accumulate streamed text, aborting early when a summary response is malformed"""
+        parts = []
+        received = 0
+        check_marker = "SUMMARY:" in instructions
+        
+        async for delta in deltas:
+            parts.append(delta)
+            received += len(delta)
+            if check_marker and received >= SUMMARY_MARKER_WINDOW:
+                if "SUMMARY:" not in "".join(parts):
+                    raise ValueError("Malformed response: no SUMMARY section")
+                check_marker = False
+        
+        return "".join(parts)
+    
+    def _chunk_text(self, text: str, chunk_size: int = 6000, overlap: int = 200, limit: Optional[int] = None) -> List[str]:
+        """Split text into overlapping chunks, preferring to break on whitespace; stops after limit chunks"""
+        if len(text) <= chunk_size:
+            return [text]
+        
+        chunks = []
+        start = 0
+        while start < len(text):
+            end = min(start + chunk_size, len(text))
+            if end < len(text):
+                # Avoid cutting a word in half when a nearby break exists
+                split_at = text.rfind(" ", start + chunk_size - overlap, end)
+                if split_at > start:
+                    end = split_at
+            chunks.append(text[start:end])
+            if end >= len(text) or len(chunks) == limit:
+                break
+            start = end - overlap
+        return chunks
+    
+    async def _request(self, instructions: str, text: str) -> Tuple[str, int, int]:
+        """Rate-limited completion, served from the response cache when possible"""
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(self.model_name, instructions, text, TEMPERATURE, MAX_OUTPUT_TOKENS)
+            cached = await self.cache.get(key)
+            if cached is not None:
+                # Nothing was sent to the provider, so nothing is billed
+                return cached["content"], 0, 0
+        
+        async with self._semaphore:
+            try:
+                content, input_tokens, output_tokens = await self._complete(instructions, text)
+            except asyncio.CancelledError:
+                # e.g. a losing hedge: the prompt was sent and is billed even though the answer is dropped
+                _record_usage(self.estimate_tokens(instructions) + self.estimate_tokens(text), 0)
+                raise
+        _record_usage(input_tokens, output_tokens)
+        
+        if key is not None:
+            await self.cache.set(key, {"content": content})
+        return content, input_tokens, output_tokens
+    
+    async def _summarize_chunk(self, chunk: str) -> Tuple[str, int, int]:
+        return await self._request(CHUNK_INSTRUCTIONS, chunk)
+    
+    def map_chunks(self, text: str) -> Tuple[List[str], bool]:
+        """Chunks for the map step, capped at ai_max_map_chunks, and whether the text was cut"""
+        chunks = self._chunk_text(text, limit=settings.ai_max_map_chunks + 1)
+        return chunks[:settings.ai_max_map_chunks], len(chunks) > settings.ai_max_map_chunks
+    
+    def fits_reduce(self, text: str) -> bool:
+        return self.estimate_tokens(text) <= REDUCE_TOKEN_BUDGET
+    
+    async def _map_reduce(self, text: str, max_length: int) -> Tuple[str, int, int, bool]:
+        """Summarize every chunk in parallel, re-chunking the partials until they fit one final call
+        
+        Returns (content, input_tokens, output_tokens, truncated); truncated is set when the
+        document exceeded the map cap or the partials had to be cut to fit the final call.
+        """
+        chunks, truncated = self.map_chunks(text)
+        
+        if len(chunks) == 1 and not truncated:
+            return (*await self._request(SUMMARY_INSTRUCTIONS.format(max_length=max_length), text), False)
+        
+        input_tokens = output_tokens = 0
+        for _ in range(MAX_REDUCE_ROUNDS):
+            partials = await asyncio.gather(*(self._summarize_chunk(c) for c in chunks), return_exceptions=True)
+            
+            for partial in partials:
+                if isinstance(partial, BaseException):
+                    raise partial
+            
+            input_tokens += sum(p[1] for p in partials)
+            output_tokens += sum(p[2] for p in partials)
+            combined = "\n\n".join(content for content, _, _ in partials)
+            if self.fits_reduce(combined):
+                break
+            chunks = self._chunk_text(combined)
+        else:
+            # Still over budget: reduce the leading partials (~4 characters per token)
+            combined = self._chunk_text(combined, chunk_size=REDUCE_TOKEN_BUDGET * 4, limit=1)[0]
+            truncated = True
+        
+        content, final_input, final_output = await self._request(
+            SUMMARY_INSTRUCTIONS.format(max_length=max_length), combined
+        )
+        return content, input_tokens + final_input, output_tokens + final_output, truncated
+    
+    def _batch_requests(self, docs: List[Tuple[str, int]], max_length: int, final: bool) -> List[Tuple[str, str, str]]:
+        """Plan (custom_id, instructions, text) batch requests for (text, job_id) pairs
+        
+        Documents that fit in one chunk get the full summary prompt under
+        custom_id "job-{id}". Longer documents are mapped as one request per
+        chunk ("job-{id}-chunk-{n}"); the caller reduces the partials with a
+        second batch submitted with final=True.
+        """
+        requests = []
+        for text, job_id in docs:
+            chunks = [text] if final else self.map_chunks(text)[0]
+            if len(chunks) == 1:
+                requests.append((f"job-{job_id}", SUMMARY_INSTRUCTIONS.format(max_length=max_length), text))
+            else:
+                requests.extend(
+                    (f"job-{job_id}-chunk-{i}", CHUNK_INSTRUCTIONS, chunk)
+                    for i, chunk in enumerate(chunks)
+                )
+        return requests
+    
+    def estimate_batch_cost(self, input_tokens: int, output_tokens: int) -> float:
+        return self.estimate_cost(input_tokens, output_tokens) * BATCH_DISCOUNT
+    
+    def parse_response(self, content: str) -> Tuple[str, List[str]]:
+        """Return (summary, key_points) from a SUMMARY/KEY POINTS/ENTITIES response"""
+        match = _RESPONSE_RE.search(content)
+        if not match:
+            return "", self.extract_key_points(content)
+        
+        # Only read bullets from the KEY POINTS section so entity lines aren't mistaken for points
+        key_points_text = match.group("key_points")
+        key_points = self.extract_key_points(key_points_text if key_points_text is not None else content)
+        return match.group("summary"), key_points
+    
     @abstractmethod
     def estimate_tokens(self, text: str) -> int:
         pass
@@ -36,37 +288,18 @@ class AIProvider(ABC):
         pass
     
     def extract_key_points(self, text: str) -> List[str]:
-        lines = text.split('\n')
-        key_points = []
-        for line in lines:
-            line = line.strip()
-            if line and (line.startswith('•') or line.startswith('-') or line.startswith('*')):
-                key_points.append(line.lstrip('•-* '))
-        return key_points[:5]  # Top 5 key points
+        return [m.group(1) for m in itertools.islice(_BULLET_RE.finditer(text), MAX_KEY_POINTS)]
     
     def extract_entities(self, text: str) -> List[Dict[str, str]]:
         entities = []
-        # Simple entity extraction (can be enhanced with NER)
-        import re
-        
-        # Extract emails
-        emails = re.findall(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', text)
-        for email in emails:
-            entities.append({"type": "email", "value": email})
-        
-        # Extract URLs
-        urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', text)
-        for url in urls:
-            entities.append({"type": "url", "value": url})
-        
-        # Extract dates (simple pattern)
-        dates = re.findall(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b', text)
-        for date in dates:
-            entities.append({"type": "date", "value": date})
-        
-        # Extract monetary amounts
-        amounts = re.findall(r'\$[\d,]+\.?\d*', text)
-        for amount in amounts:
-            entities.append({"type": "money", "value": amount})
+        # Simple entity extraction (can be enhanced with NER); each scan stops once the cap is reached
+        for entity_type, pattern in _ENTITY_PATTERNS:
+            remaining = MAX_ENTITIES - len(entities)
+            if remaining <= 0:
+                break
+            entities.extend(
+                {"type": entity_type, "value": match.group(0)}
+                for match in itertools.islice(pattern.finditer(text), remaining)
+            )
         
-        return entities[:10]  # Limit to 10 entities
\ No newline at end of file
+        return entities
\ No newline at end of file
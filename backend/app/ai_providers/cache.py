@@ -0,0 +1,59 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Optional
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+def hash_text(text: str) -> str:
+    """128-bit BLAKE2b fingerprint; faster than md5/sha256 on multi-MB document text"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+class RedisLLMCache:
+    """Response cache for LLM completions, keyed by model and request parameters.
+    
+    The cache is best-effort: any Redis error is logged and treated as a miss
+    so summarization never fails because the cache is unavailable.
+    """
+    
+    def __init__(self, redis_url: str, ttl: int = 86400, prefix: str = "llm:"):
+        self._redis = aioredis.from_url(redis_url, socket_connect_timeout=1, socket_timeout=1)
+        self.ttl = ttl
+        self.prefix = prefix
+    
+    @staticmethod
+    def make_key(model: str, instructions: str, text: str, temperature: float, max_tokens: int) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": [instructions, text],
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            },
+            sort_keys=True
+        )
+        return hash_text(payload)
+    
+    @staticmethod
+    def make_summary_key(provider: str, prompt_version: int, text: str, max_length: int) -> str:
+        """Key for a whole-document SummaryResult"""
+        return f"summary:{provider}:v{prompt_version}:{max_length}:{hash_text(text)}"
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = await self._redis.get(self.prefix + key)
+        except RedisError:
+            logger.warning("LLM cache read failed", exc_info=True)
+            return None
+        return json.loads(raw) if raw else None
+    
+    async def set(self, key: str, value: Dict[str, Any], ttl: Optional[int] = None):
+        try:
+            await self._redis.set(self.prefix + key, json.dumps(value), ex=ttl or self.ttl)
+        except RedisError:
+            logger.warning("LLM cache write failed", exc_info=True)
+    
+    async def aclose(self):
+        await self._redis.aclose()
\ No newline at end of file
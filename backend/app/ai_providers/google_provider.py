@@ -1,17 +1,24 @@
 import google.generativeai as genai
-from typing import List, Dict
-from .base import AIProvider, SummaryResult
-from ..config import settings
 import asyncio
+from typing import List, Dict, Optional, Tuple
+from .base import AIProvider, SummaryResult, count_tokens, TEMPERATURE, MAX_OUTPUT_TOKENS
+from .cache import RedisLLMCache
+from ..config import settings
 
 class GoogleProvider(AIProvider):
-    def __init__(self, api_key: str, model_name: str = "gemini-pro"):
-        super().__init__(api_key, model_name)
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str = "gemini-pro",
+        cache: Optional[RedisLLMCache] = None
+    ):
+        super().__init__(api_key, model_name, settings.ai_max_concurrency, cache)
         if api_key:
             genai.configure(api_key=api_key)
             self.model = genai.GenerativeModel(model_name)
         else:
             self.model = None
+        self._generation_config = {"temperature": TEMPERATURE, "max_output_tokens": MAX_OUTPUT_TOKENS}
         self.input_cost_per_1k = settings.google_gemini_input_cost
         self.output_cost_per_1k = settings.google_gemini_output_cost
     
@@ -20,45 +27,16 @@ class GoogleProvider(AIProvider):
             raise ValueError("Google API key not configured")
         
         try:
-            prompt = f"""Please provide a comprehensive summary of the following document in approximately {max_length} words.
-            Also extract:
-            1. Key points (as bullet points)
-            2. Important entities (people, organizations, dates, etc.)
-            
-            Document:
-            {text[:8000]}  # Limit input
-            
-            Format your response as:
-            SUMMARY:
-            [Your summary here]
-            
-            KEY POINTS:
-            • [Point 1]
-            • [Point 2]
-            • [Point 3]
-            
-            ENTITIES:
-            - [Entity 1: Type]
-            - [Entity 2: Type]
-            """
-            
-            # Run in executor since the SDK is synchronous
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(None, self.model.generate_content, prompt)
-            
-            content = response.text
+            # Entity extraction only needs the source text, so overlap it with the LLM call
+            (content, input_tokens, output_tokens, truncated), entities = await asyncio.gather(
+                self._map_reduce(text, max_length),
+                asyncio.to_thread(self.extract_entities, text)
+            )
             
             # Parse response
-            summary = ""
-            if "SUMMARY:" in content:
-                summary = content.split("SUMMARY:")[1].split("KEY POINTS:")[0].strip()
-            
-            key_points = self.extract_key_points(content)
-            entities = self.extract_entities(text)
+            summary, key_points = self.parse_response(content)
             
             # Estimate tokens
-            input_tokens = self.estimate_tokens(text)
-            output_tokens = self.estimate_tokens(content)
             total_tokens = input_tokens + output_tokens
             cost = self.estimate_cost(input_tokens, output_tokens)
             
@@ -68,15 +46,29 @@ class GoogleProvider(AIProvider):
                 entities=entities,
                 tokens_used=total_tokens,
                 cost=cost,
-                provider_used=f"Google/{self.model_name}"
+                provider_used=f"Google/{self.model_name}",
+                truncated=truncated
             )
             
         except Exception as e:
             raise Exception(f"Google Gemini summarization failed: {str(e)}")
     
+    async def _complete(self, instructions: str, text: str) -> Tuple[str, int, int]:
+        # This SDK version has no system instructions; keep the static part as the prefix
+        prompt = f"{instructions}\n{text}"
+        
+        # Native async call, no executor thread per request
+        response = await self.model.generate_content_async(
+            prompt,
+            generation_config=self._generation_config
+        )
+        
+        content = response.text
+        return content, self.estimate_tokens(prompt), self.estimate_tokens(content)
+    
     def estimate_tokens(self, text: str) -> int:
-        # Rough estimation for Gemini
-        return len(text) // 4
+        # cl100k approximation for Gemini
+        return count_tokens(text)
     
     def is_available(self) -> bool:
         return self.model is not None
\ No newline at end of file
@@ -1,49 +1,114 @@
-from typing import Optional, List
-from .base import AIProvider, SummaryResult
+from typing import Dict, Optional, List
+from dataclasses import asdict, replace
+from .base import AIProvider, SummaryResult, UsageMeter, metered, PROMPT_VERSION
 from .openai_provider import OpenAIProvider
 from .anthropic_provider import AnthropicProvider
 from .google_provider import GoogleProvider
+from .cache import RedisLLMCache
 from ..config import settings
 from ..models import AIProvider as AIProviderEnum
 import random
 import asyncio
+import httpx
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Hosts warmed by preconnect; any response, even a 404, leaves the connection pooled
+OPENAI_BASE_URL = "https://api.openai.com/"
+ANTHROPIC_BASE_URL = "https://api.anthropic.com/"
+PRECONNECT_TIMEOUT = 5.0  # seconds
+KEEPALIVE_EXPIRY = 60.0  # seconds an idle pooled connection stays open
+
+# Summaries being generated on this process's event loop, by summary cache key;
+# concurrent jobs for the same text and provider share one set of LLM calls
+_inflight_summaries: Dict[str, asyncio.Future] = {}
+
+def _create_http_client() -> httpx.AsyncClient:
+    """Pooled keep-alive client shared by every model of one vendor"""
+    return httpx.AsyncClient(
+        # Shared by every task in a worker process; idle connections stay open between jobs
+        limits=httpx.Limits(max_connections=500, max_keepalive_connections=100, keepalive_expiry=KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(600.0, connect=5.0),
+        http2=True,
+    )
 
 class AIProviderManager:
     def __init__(self):
-        self.providers = {}
+        self._providers = {}
+        self._openai_http = _create_http_client() if settings.openai_api_key else None
+        self._anthropic_http = _create_http_client() if settings.anthropic_api_key else None
+        # Per pooled client, when its last warm-up connection may have idled out
+        self._warm_until = {}
+        self.cache = None
+        if settings.llm_cache_enabled and settings.redis_url.startswith("redis://"):
+            self.cache = RedisLLMCache(settings.redis_url, ttl=settings.llm_cache_ttl)
         self._initialize_providers()
     
     def _initialize_providers(self):
-        # Initialize OpenAI providers
+        # Register factories only; each SDK client is built on first use
+        self._factories = {}
+        
+        # OpenAI providers (both models share one connection pool)
         if settings.openai_api_key:
-            self.providers[AIProviderEnum.OPENAI_GPT4] = OpenAIProvider(
-                settings.openai_api_key, "gpt-4"
+            self._factories[AIProviderEnum.OPENAI_GPT4] = lambda: OpenAIProvider(
+                settings.openai_api_key, "gpt-4", http_client=self._openai_http, cache=self.cache
             )
-            self.providers[AIProviderEnum.OPENAI_GPT35] = OpenAIProvider(
-                settings.openai_api_key, "gpt-3.5-turbo"
+            self._factories[AIProviderEnum.OPENAI_GPT35] = lambda: OpenAIProvider(
+                settings.openai_api_key, "gpt-3.5-turbo", http_client=self._openai_http, cache=self.cache
             )
         
-        # Initialize Anthropic provider
+        # Anthropic provider
         if settings.anthropic_api_key:
-            self.providers[AIProviderEnum.ANTHROPIC_CLAUDE] = AnthropicProvider(
-                settings.anthropic_api_key
+            self._factories[AIProviderEnum.ANTHROPIC_CLAUDE] = lambda: AnthropicProvider(
+                settings.anthropic_api_key, http_client=self._anthropic_http, cache=self.cache
             )
         
-        # Initialize Google provider
+        # Google provider
         if settings.google_api_key:
-            self.providers[AIProviderEnum.GOOGLE_GEMINI] = GoogleProvider(
-                settings.google_api_key
+            self._factories[AIProviderEnum.GOOGLE_GEMINI] = lambda: GoogleProvider(
+                settings.google_api_key, cache=self.cache
             )
     
+    async def aclose(self):
+        """Close the shared HTTP connection pools and the response cache"""
+        for client in (self._openai_http, self._anthropic_http):
+            if client is not None:
+                await client.aclose()
+        if self.cache is not None:
+            await self.cache.aclose()
+    
+    async def preconnect(self, provider_type: AIProviderEnum):
+        """Open the pooled connection (TCP, TLS, HTTP/2) to a provider ahead of its first request"""
+        if provider_type in (AIProviderEnum.OPENAI_GPT4, AIProviderEnum.OPENAI_GPT35):
+            client, url = self._openai_http, OPENAI_BASE_URL
+        elif provider_type == AIProviderEnum.ANTHROPIC_CLAUDE:
+            client, url = self._anthropic_http, ANTHROPIC_BASE_URL
+        else:
+            return  # Gemini's SDK manages its own transport
+        if client is None or time.monotonic() < self._warm_until.get(client, 0.0):
+            return
+        
+        self._warm_until[client] = time.monotonic() + KEEPALIVE_EXPIRY
+        try:
+            await client.head(url, timeout=PRECONNECT_TIMEOUT)
+        except Exception:
+            # Only a warm-up; the real request connects on its own
+            logger.debug("Preconnect to %s failed", provider_type, exc_info=True)
+    
     def get_provider(self, provider_type: AIProviderEnum) -> Optional[AIProvider]:
-        return self.providers.get(provider_type)
+        if provider_type not in self._providers:
+            factory = self._factories.get(provider_type)
+            if factory is None:
+                return None
+            self._providers[provider_type] = factory()
+        return self._providers[provider_type]
     
     def get_available_providers(self) -> List[AIProviderEnum]:
-        available = []
-        for provider_type, provider in self.providers.items():
-            if provider.is_available():
-                available.append(provider_type)
-        return available
+        # Factories are only registered for configured API keys, so listing
+        # them doesn't need to build any client
+        return list(self._factories)
     
     async def summarize_with_fallback(
         self,
@@ -58,22 +123,59 @@ class AIProviderManager:
         if demo_mode:
             return await self._demo_summarize(text, primary_provider)
         
-        # Try primary provider
-        primary = self.get_provider(primary_provider)
-        if primary and primary.is_available():
+        # The same text summarized for the same provider skips every LLM call
+        key = RedisLLMCache.make_summary_key(primary_provider.value, PROMPT_VERSION, text, max_length)
+        if self.cache is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                # Nothing was sent to a provider, so nothing is billed
+                return SummaryResult(**{**cached, "tokens_used": 0, "cost": 0.0, "cached": True})
+        
+        # Join an identical request that is already in flight (e.g. a burst of re-uploads)
+        shared = _inflight_summaries.get(key)
+        if shared is not None:
+            result = await asyncio.shield(shared)
+            return replace(result, tokens_used=0, cost=0.0, cached=True)
+        
+        shared = asyncio.ensure_future(
+            self._summarize_and_cache(key, text, primary_provider, fallback_provider, max_length)
+        )
+        _inflight_summaries[key] = shared
+        shared.add_done_callback(lambda _: _inflight_summaries.pop(key, None))
+        return await asyncio.shield(shared)
+    
+    async def _summarize_and_cache(
+        self,
+        key: str,
+        text: str,
+        primary_provider: AIProviderEnum,
+        fallback_provider: Optional[AIProviderEnum],
+        max_length: int
+    ) -> SummaryResult:
+        result = await self._summarize_live(text, primary_provider, fallback_provider, max_length)
+        if self.cache is not None:
+            await self.cache.set(key, asdict(result), ttl=settings.summary_cache_ttl)
+        return result
+    
+    async def _summarize_live(
+        self,
+        text: str,
+        primary_provider: AIProviderEnum,
+        fallback_provider: Optional[AIProviderEnum],
+        max_length: int
+    ) -> SummaryResult:
+        # Try primary provider, hedging with the fallback if the primary is slow
+        candidates = []
+        for label, provider_type in (("Primary", primary_provider), ("Fallback", fallback_provider)):
+            provider = self.get_provider(provider_type) if provider_type else None
+            if provider and provider.is_available():
+                candidates.append((label, provider_type, provider))
+        
+        if candidates:
             try:
-                return await primary.summarize(text, max_length)
-            except Exception as e:
-                print(f"Primary provider {primary_provider} failed: {e}")
-        
-        # Try fallback provider
-        if fallback_provider:
-            fallback = self.get_provider(fallback_provider)
-            if fallback and fallback.is_available():
-                try:
-                    return await fallback.summarize(text, max_length)
-                except Exception as e:
-                    print(f"Fallback provider {fallback_provider} failed: {e}")
+                return await self._hedged_summarize(candidates, text, max_length)
+            except Exception:
+                pass  # Each failure was already reported
         
         # Try any available provider
         available = self.get_available_providers()
@@ -82,11 +184,77 @@ class AIProviderManager:
                 provider = self.get_provider(provider_type)
                 try:
                     return await provider.summarize(text, max_length)
-                except Exception as e:
-                    print(f"Provider {provider_type} failed: {e}")
+                except Exception:
+                    logger.warning("Provider %s failed", provider_type, exc_info=True)
         
         raise Exception("All AI providers failed or unavailable")
     
+    async def _hedged_summarize(self, candidates, text: str, max_length: int) -> SummaryResult:
+        """Run the first candidate and start the next one if it fails, or, with
+        settings.ai_hedge_delay set, if it is still running after that many seconds.
+        The first success wins and is charged for what the other candidates sent."""
+        
+        hedge_delay = settings.ai_hedge_delay or None
+        pending = set()
+        labels = {}
+        meters = {}
+        winner = None
+        last_error = None
+        
+        try:
+            for index, (label, provider_type, provider) in enumerate(candidates):
+                meter = UsageMeter()
+                task = asyncio.create_task(metered(provider.summarize(text, max_length), meter))
+                labels[task] = (label, provider_type)
+                meters[task] = (provider, meter)
+                pending.add(task)
+                
+                # Only wait for the hedge delay while there is another candidate to launch
+                is_last = index == len(candidates) - 1
+                while pending and winner is None:
+                    done, pending = await asyncio.wait(
+                        pending,
+                        timeout=None if is_last else hedge_delay,
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not done:
+                        break  # Timed out: hedge with the next candidate
+                    
+                    for finished in done:
+                        if finished.exception() is None:
+                            winner = finished
+                            break
+                        last_error = finished.exception()
+                        failed_label, failed_type = labels[finished]
+                        logger.warning(
+                            "%s provider %s failed", failed_label, failed_type, exc_info=last_error
+                        )
+                    
+                    if not is_last:
+                        break  # Failed fast: launch the next candidate now
+                if winner is not None:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        if winner is None:
+            raise last_error or Exception("All hedged providers failed")
+        
+        # Requests sent by losing or failed candidates are billed too
+        result = winner.result()
+        extra_tokens = 0
+        extra_cost = 0.0
+        for task, (provider, meter) in meters.items():
+            if task is not winner:
+                extra_tokens += meter.input_tokens + meter.output_tokens
+                extra_cost += provider.estimate_cost(meter.input_tokens, meter.output_tokens)
+        if extra_tokens:
+            result = replace(result, tokens_used=result.tokens_used + extra_tokens, cost=result.cost + extra_cost)
+        return result
+    
     async def _demo_summarize(self, text: str, provider: AIProviderEnum) -> SummaryResult:
         # Simulate processing delay
         delay = random.uniform(1, 5)
@@ -133,7 +301,12 @@ class AIProviderManager:
     def estimate_cost(self, text: str, provider: AIProviderEnum) -> float:
         p = self.get_provider(provider)
         if p:
-            tokens = p.estimate_tokens(text)
+            return self.estimate_cost_from_tokens(p.estimate_tokens(text), provider)
+        return 0.0
+    
+    def estimate_cost_from_tokens(self, tokens: int, provider: AIProviderEnum) -> float:
+        p = self.get_provider(provider)
+        if p:
             # Assume output is ~20% of input
             output_tokens = tokens // 5
             return p.estimate_cost(tokens, output_tokens)
@@ -1,14 +1,31 @@
 import openai
-from typing import List, Dict
-from .base import AIProvider, SummaryResult
-import tiktoken
+import httpx
+import json
 import asyncio
+from typing import List, Dict, Optional, Tuple
+from .base import AIProvider, SummaryResult, count_tokens, TEMPERATURE, MAX_OUTPUT_TOKENS
+import tiktoken
+from .cache import RedisLLMCache
 from ..config import settings
 
+BATCH_ENDPOINT = "/v1/chat/completions"
+
 class OpenAIProvider(AIProvider):
-    def __init__(self, api_key: str, model_name: str = "gpt-3.5-turbo"):
-        super().__init__(api_key, model_name)
-        self.client = openai.AsyncOpenAI(api_key=api_key) if api_key else None
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str = "gpt-3.5-turbo",
+        http_client: Optional[httpx.AsyncClient] = None,
+        cache: Optional[RedisLLMCache] = None
+    ):
+        super().__init__(api_key, model_name, settings.ai_max_concurrency, cache)
+        self.client = openai.AsyncOpenAI(api_key=api_key, http_client=http_client) if api_key else None
+        
+        # Resolve the encoding once instead of on every estimate
+        try:
+            self._encoding_name = tiktoken.encoding_name_for_model(model_name)
+        except KeyError:
+            self._encoding_name = "cl100k_base"
         
         if model_name == "gpt-4":
             self.input_cost_per_1k = settings.openai_gpt4_input_cost
@@ -22,55 +39,16 @@ class OpenAIProvider(AIProvider):
             raise ValueError("OpenAI API key not configured")
         
         try:
-            # Prepare the prompt
-            prompt = f"""Please provide a comprehensive summary of the following document in approximately {max_length} words.
-            Also extract:
-            1. Key points (as bullet points)
-            2. Important entities (people, organizations, dates, etc.)
-            
-            Document:
-            {text[:8000]}  # Limit input to avoid token limits
-            
-            Format your response as:
-            SUMMARY:
-            [Your summary here]
-            
-            KEY POINTS:
-            • [Point 1]
-            • [Point 2]
-            • [Point 3]
-            
-            ENTITIES:
-            - [Entity 1: Type]
-            - [Entity 2: Type]
-            """
-            
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": "You are a helpful document summarization assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.3
+            # Entity extraction only needs the source text, so overlap it with the LLM call
+            (content, input_tokens, output_tokens, truncated), entities = await asyncio.gather(
+                self._map_reduce(text, max_length),
+                asyncio.to_thread(self.extract_entities, text)
             )
             
-            content = response.choices[0].message.content
-            
             # Parse response
-            summary = ""
-            key_points = []
-            entities = []
-            
-            if "SUMMARY:" in content:
-                summary = content.split("SUMMARY:")[1].split("KEY POINTS:")[0].strip()
-            
-            key_points = self.extract_key_points(content)
-            entities = self.extract_entities(text)
+            summary, key_points = self.parse_response(content)
             
             # Calculate tokens and cost
-            input_tokens = response.usage.prompt_tokens
-            output_tokens = response.usage.completion_tokens
             total_tokens = input_tokens + output_tokens
             cost = self.estimate_cost(input_tokens, output_tokens)
             
@@ -80,19 +58,105 @@ class OpenAIProvider(AIProvider):
                 entities=entities,
                 tokens_used=total_tokens,
                 cost=cost,
-                provider_used=f"OpenAI/{self.model_name}"
+                provider_used=f"OpenAI/{self.model_name}",
+                truncated=truncated
             )
             
         except Exception as e:
             raise Exception(f"OpenAI summarization failed: {str(e)}")
     
-    def estimate_tokens(self, text: str) -> int:
+    def _messages(self, instructions: str, text: str) -> List[Dict[str, str]]:
+        # The static system message is the shared prefix OpenAI caches automatically
+        return [
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": text}
+        ]
+    
+    async def _complete(self, instructions: str, text: str) -> Tuple[str, int, int]:
+        stream = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=self._messages(instructions, text),
+            max_tokens=MAX_OUTPUT_TOKENS,
+            temperature=TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        usage = {}
+        
+        async def deltas():
+            async for chunk in stream:
+                # The final chunk carries usage and no choices
+                if chunk.usage:
+                    usage["input"] = chunk.usage.prompt_tokens
+                    usage["output"] = chunk.usage.completion_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        
         try:
-            encoding = tiktoken.encoding_for_model(self.model_name)
-            return len(encoding.encode(text))
-        except:
-            # Fallback estimation: ~4 chars per token
-            return len(text) // 4
+            content = await self._collect_stream(deltas(), instructions)
+        finally:
+            await stream.close()
+        
+        input_tokens = usage.get("input", self.estimate_tokens(instructions) + self.estimate_tokens(text))
+        output_tokens = usage.get("output", self.estimate_tokens(content))
+        return content, input_tokens, output_tokens
+    
+    async def submit_batch(self, docs: List[Tuple[str, int]], max_length: int = 500, final: bool = False) -> str:
+        """Queue (text, job_id) pairs on the Batch API and return the batch id"""
+        if not self.client:
+            raise ValueError("OpenAI API key not configured")
+        
+        lines = [
+            json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": self.model_name,
+                    "messages": self._messages(instructions, content),
+                    "max_tokens": MAX_OUTPUT_TOKENS,
+                    "temperature": TEMPERATURE
+                }
+            })
+            for custom_id, instructions, content in self._batch_requests(docs, max_length, final)
+        ]
+        
+        batch_file = await self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+        return batch.id
+    
+    async def fetch_batch(self, batch_id: str) -> Tuple[str, Dict[str, Tuple[str, int, int]]]:
+        """Return the batch status and, once completed, {custom_id: (content, input_tokens, output_tokens)}"""
+        batch = await self.client.batches.retrieve(batch_id)
+        results = {}
+        
+        if batch.status == "completed" and batch.output_file_id:
+            output = await self.client.files.content(batch.output_file_id)
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    continue
+                body = response["body"]
+                results[record["custom_id"]] = (
+                    body["choices"][0]["message"]["content"],
+                    body["usage"]["prompt_tokens"],
+                    body["usage"]["completion_tokens"]
+                )
+        
+        return batch.status, results
+    
+    def estimate_tokens(self, text: str) -> int:
+        return count_tokens(text, self._encoding_name)
     
     def is_available(self) -> bool:
         return self.client is not None
\ No newline at end of file
@@ -1,11 +1,21 @@
 from celery import Celery
+from celery.signals import worker_process_init
+from gevent import monkey
+from psycogreen.gevent import patch_psycopg
 from .config import settings
+from .database import engine
 from .sentry_config import init_sentry
 import os
 
 # Initialize Sentry for Celery worker
 init_sentry()
 
+# Under -P gevent the pool has monkey-patched the standard library before this
+# import; psycopg2 is a C driver, so it needs its own wait callback to yield to
+# the hub instead of blocking every green thread during a query
+if monkey.is_module_patched('socket'):
+    patch_psycopg()
+
 # In demo mode, use in-memory broker if Redis is not available
 if settings.demo_mode and not settings.redis_url.startswith('redis://'):
     # Use in-memory broker for demo mode when Redis is not available
@@ -25,16 +35,40 @@ celery_app = Celery(
 
 # Configure Celery
 celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
+    # msgpack is smaller and faster than json; json is still accepted for
+    # messages queued by older producers
+    task_serializer='msgpack',
+    accept_content=['msgpack', 'json'],
+    result_serializer='msgpack',
     timezone='UTC',
     enable_utc=True,
     task_track_started=True,
     task_time_limit=30 * 60,  # 30 minutes
     task_soft_time_limit=25 * 60,  # 25 minutes
+    # Tasks are I/O-bound on LLM APIs, so workers run on the gevent pool
+    # (celery -A app.celery_app worker -P gevent -c 100 -Ofair), which patches
+    # the standard library before the app is imported. Jobs run for up to a
+    # minute, so each green thread reserves only the message it is working on
+    # and -Ofair hands new ones to free workers instead of queueing them behind
+    # busy ones; acks_late redelivers them if a worker dies mid-task.
     worker_prefetch_multiplier=1,
-    worker_max_tasks_per_child=1000,
+    task_acks_late=True,
+    # ...including when a prefork child is killed mid-task, e.g. by the OOM killer
+    task_reject_on_worker_lost=True,
+    worker_max_tasks_per_child=500,  # recycle children to bound gevent-patched leaks
+    # Green threads publish retries and demo groups concurrently; one broker connection each
+    broker_pool_limit=100,
+    # Demo data goes to its own queue so a large batch can't sit in front of real jobs
+    task_routes={'app.tasks.generate_demo_jobs': {'queue': 'demo'}},
+    # Set on the demo worker (-Q demo) only, so demo fan-out is throttled where it is
+    # consumed while the main worker (-Q celery) runs user jobs unthrottled
+    task_annotations={'app.tasks.process_document': {'rate_limit': settings.process_document_rate_limit}}
+    if settings.process_document_rate_limit else None,
     # For in-memory broker
     task_always_eager=settings.demo_mode and broker_url == 'memory://',
-)
\ No newline at end of file
+)
+
+@worker_process_init.connect
+def _dispose_db_pool(**kwargs):
+    # Connections inherited from a prefork parent must not be shared; each child opens its own
+    engine.dispose(close=False)
\ No newline at end of file
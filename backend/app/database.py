@@ -12,7 +12,14 @@ if "sqlite" in settings.database_url:
         poolclass=StaticPool,
     )
 else:
-    engine = create_engine(settings.database_url)
+    engine = create_engine(
+        settings.database_url,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=settings.db_pool_recycle,
+        isolation_level="READ COMMITTED",
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
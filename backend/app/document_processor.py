@@ -1,11 +1,93 @@
+import hashlib
+import io
 import os
-import PyPDF2
+import pickle
+import threading
+import pypdfium2 as pdfium
 import docx
+from celery.signals import worker_process_init
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from gevent import monkey
+from itertools import chain
 from PIL import Image
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple, Union
 from .models import DocumentType
 from .config import settings
 
+_EXT_TO_TYPE = {
+    ".pdf": DocumentType.PDF,
+    ".docx": DocumentType.DOCX,
+    ".doc": DocumentType.DOCX,
+    ".txt": DocumentType.TXT,
+    ".text": DocumentType.TXT,
+    ".png": DocumentType.IMAGE,
+    ".jpg": DocumentType.IMAGE,
+    ".jpeg": DocumentType.IMAGE,
+    ".gif": DocumentType.IMAGE,
+    ".bmp": DocumentType.IMAGE,
+}
+
+# Rough tokens per stored byte, calibrated on sample uploads. Compressed and
+# binary formats carry far less text per byte than plain text.
+TOKENS_PER_BYTE = {
+    DocumentType.PDF: 0.15,
+    DocumentType.DOCX: 0.1,
+    DocumentType.TXT: 0.25,
+    DocumentType.IMAGE: 0.002,
+    DocumentType.UNKNOWN: 0.25,
+}
+
+# PDFium is not thread-safe, so large PDFs are split across processes
+PARALLEL_PDF_MIN_PAGES = 16
+# Size of the one page-extraction pool each process shares across its tasks
+PDF_POOL_WORKERS = min(os.cpu_count() or 1, 4)
+
+HASH_CHUNK_SIZE = 1024 * 1024  # bytes read per file_hash update
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool() -> Optional[ProcessPoolExecutor]:
+    """Shared page-extraction pool, created on first use; None when pages must be read serially"""
+    global _pdf_pool
+    # Under -P gevent a task thread is a greenlet, and the pool's management
+    # thread and pipes would block the hub; read pages in-process instead
+    if PDF_POOL_WORKERS < 2 or monkey.is_module_patched("socket"):
+        return None
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_POOL_WORKERS)
+        return _pdf_pool
+
+def _discard_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        pool, _pdf_pool = _pdf_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@worker_process_init.connect
+def _reset_pdf_pool(**kwargs):
+    # A pool inherited from the prefork parent has no live processes in this child
+    global _pdf_pool
+    _pdf_pool = None
+
+def _extract_pdf_pages(source: Union[str, bytes], start: int, stop: int) -> List[str]:
+    """Extract text for pages [start, stop); module-level so it can run in a worker process"""
+    pdf = pdfium.PdfDocument(source)
+    try:
+        parts = []
+        for page_num in range(start, stop):
+            page = pdf[page_num]
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return parts
+    finally:
+        pdf.close()
+
 class DocumentProcessor:
     @staticmethod
     def extract_text(file_path: str, document_type: DocumentType) -> Tuple[str, int]:
@@ -27,6 +109,20 @@ class DocumentProcessor:
             # Try to detect and extract
             return DocumentProcessor._auto_extract(file_path)
     
+    @staticmethod
+    def extract_text_from_bytes(data: bytes, document_type: DocumentType) -> Tuple[str, int]:
+        """Extract text from an in-memory document and return (text, page_count)"""
+        
+        if document_type == DocumentType.PDF:
+            return DocumentProcessor._extract_pdf(data)
+        elif document_type == DocumentType.DOCX:
+            return DocumentProcessor._extract_docx(io.BytesIO(data))
+        elif document_type == DocumentType.IMAGE:
+            return DocumentProcessor._extract_image(io.BytesIO(data))
+        elif document_type == DocumentType.UNKNOWN and settings.demo_mode:
+            return DocumentProcessor._get_demo_text(DocumentType.UNKNOWN)
+        return DocumentProcessor._extract_txt(data)
+    
     @staticmethod
     def _get_demo_text(document_type: DocumentType) -> Tuple[str, int]:
         """Return demo text for different document types"""
@@ -48,18 +144,25 @@ class DocumentProcessor:
         return demo_texts.get(document_type, demo_texts[DocumentType.UNKNOWN])
     
     @staticmethod
-    def _extract_pdf(file_path: str) -> Tuple[str, int]:
+    def _extract_pdf(source: Union[str, bytes]) -> Tuple[str, int]:
         text = ""
         page_count = 0
         
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                page_count = len(pdf_reader.pages)
-                
-                for page_num in range(page_count):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
+            pdf = pdfium.PdfDocument(source)
+            try:
+                page_count = len(pdf)
+            finally:
+                pdf.close()
+            
+            workers = min(PDF_POOL_WORKERS, page_count // PARALLEL_PDF_MIN_PAGES)
+            # Only files on disk are split; in-memory PDFs would be copied to every worker
+            if workers > 1 and isinstance(source, str):
+                parts = DocumentProcessor._extract_pdf_parallel(source, page_count, workers)
+            else:
+                parts = _extract_pdf_pages(source, 0, page_count)
+            
+            text = "\n".join(parts)
         except Exception as e:
             if settings.demo_mode:
                 return DocumentProcessor._get_demo_text(DocumentType.PDF)
@@ -68,12 +171,35 @@ class DocumentProcessor:
         return text.strip(), page_count
     
     @staticmethod
-    def _extract_docx(file_path: str) -> Tuple[str, int]:
+    def _extract_pdf_parallel(file_path: str, page_count: int, workers: int) -> List[str]:
+        step = -(-page_count // workers)  # ceil division
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        
+        pool = _get_pdf_pool()
+        if pool is None:
+            return _extract_pdf_pages(file_path, 0, page_count)
+        
+        try:
+            results = pool.map(
+                _extract_pdf_pages,
+                [file_path] * len(ranges),
+                [start for start, _ in ranges],
+                [stop for _, stop in ranges]
+            )
+            return list(chain.from_iterable(results))
+        except (BrokenProcessPool, pickle.PicklingError, OSError, RuntimeError, AssertionError):
+            # A pool process died (e.g. OOM-killed) or pools are unavailable in this
+            # worker setup (e.g. daemonic processes); rebuild on next use, read in one pass now
+            _discard_pdf_pool()
+            return _extract_pdf_pages(file_path, 0, page_count)
+    
+    @staticmethod
+    def _extract_docx(source: Union[str, io.BytesIO]) -> Tuple[str, int]:
         text = ""
         page_count = 1  # Approximate
         
         try:
-            doc = docx.Document(file_path)
+            doc = docx.Document(source)
             paragraphs = []
             
             for para in doc.paragraphs:
@@ -92,10 +218,13 @@ class DocumentProcessor:
         return text.strip(), page_count
     
     @staticmethod
-    def _extract_txt(file_path: str) -> Tuple[str, int]:
+    def _extract_txt(source: Union[str, bytes]) -> Tuple[str, int]:
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                text = file.read()
+            if isinstance(source, bytes):
+                text = source.decode('utf-8')
+            else:
+                with open(source, 'r', encoding='utf-8') as file:
+                    text = file.read()
             
             # Rough page estimation
             word_count = len(text.split())
@@ -108,11 +237,11 @@ class DocumentProcessor:
             raise Exception(f"Failed to extract TXT: {str(e)}")
     
     @staticmethod
-    def _extract_image(file_path: str) -> Tuple[str, int]:
+    def _extract_image(source: Union[str, io.BytesIO]) -> Tuple[str, int]:
         try:
             # Try OCR using pytesseract if available
             import pytesseract
-            image = Image.open(file_path)
+            image = Image.open(source)
             text = pytesseract.image_to_string(image)
             return text.strip(), 1
         except:
@@ -124,33 +253,30 @@ class DocumentProcessor:
     @staticmethod
     def _auto_extract(file_path: str) -> Tuple[str, int]:
         # Try to detect file type by extension
-        ext = os.path.splitext(file_path)[1].lower()
+        doc_type = DocumentProcessor.detect_document_type(file_path)
         
-        if ext == '.pdf':
-            return DocumentProcessor._extract_pdf(file_path)
-        elif ext in ['.docx', '.doc']:
-            return DocumentProcessor._extract_docx(file_path)
-        elif ext in ['.txt', '.text']:
-            return DocumentProcessor._extract_txt(file_path)
-        elif ext in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']:
-            return DocumentProcessor._extract_image(file_path)
-        else:
-            # Default to text extraction or demo
-            if settings.demo_mode:
-                return DocumentProcessor._get_demo_text(DocumentType.UNKNOWN)
-            return DocumentProcessor._extract_txt(file_path)
+        if doc_type != DocumentType.UNKNOWN:
+            return DocumentProcessor.extract_text(file_path, doc_type)
+        
+        # Default to text extraction or demo
+        if settings.demo_mode:
+            return DocumentProcessor._get_demo_text(DocumentType.UNKNOWN)
+        return DocumentProcessor._extract_txt(file_path)
+    
+    @staticmethod
+    def estimate_tokens_from_size(file_size: int, document_type: DocumentType) -> int:
+        """O(1) token estimate from the file size, without extracting anything"""
+        return int(file_size * TOKENS_PER_BYTE.get(document_type, TOKENS_PER_BYTE[DocumentType.UNKNOWN]))
+    
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        """128-bit BLAKE2b of a file's contents, read in chunks so large uploads stay out of memory"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
     
     @staticmethod
     def detect_document_type(filename: str) -> DocumentType:
-        ext = os.path.splitext(filename)[1].lower()
-        
-        if ext == '.pdf':
-            return DocumentType.PDF
-        elif ext in ['.docx', '.doc']:
-            return DocumentType.DOCX
-        elif ext in ['.txt', '.text']:
-            return DocumentType.TXT
-        elif ext in ['.png', '.jpg', '.jpeg', '.gif', '.bmp']:
-            return DocumentType.IMAGE
-        else:
-            return DocumentType.UNKNOWN
\ No newline at end of file
+        return _EXT_TO_TYPE.get(os.path.splitext(filename)[1].lower(), DocumentType.UNKNOWN)
\ No newline at end of file
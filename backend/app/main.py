@@ -1,27 +1,59 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
+import asyncio
+import json
+import logging
 import shutil
+import sys
+from pathlib import Path
 from datetime import datetime, timedelta
+from functools import lru_cache
 import uuid
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
 
 from .config import settings
 from .database import get_db, init_db
 from .models import Document, Job, JobStatus, DocumentType, AIProvider as AIProviderEnum
 from .document_processor import DocumentProcessor
+from . import storage
+from . import stats_counters
 from .ai_providers.manager import AIProviderManager
-from .tasks import process_document, generate_demo_jobs, calculate_system_stats
-from pydantic import BaseModel
+from .tasks import (
+    process_document, submit_batch_jobs, generate_demo_jobs, calculate_system_stats,
+    aggregate_system_stats, STATS_CACHE_KEY, STATS_REFRESH_KEY, BATCH_PROVIDERS
+)
+from pydantic import BaseModel, ConfigDict
+from .schemas import JobResponse, TERMINAL_STATUSES
 from .sentry_config import init_sentry
 
+logger = logging.getLogger(__name__)
+
+# Upper bound on jobs created by one /api/demo/generate-jobs call
+MAX_DEMO_JOBS = 100
+
+# Upper bound on jobs created by one /api/jobs/batch call
+MAX_BATCH_JOBS = 500
+
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+# Resolved once; created by startup_event
+UPLOAD_DIR = Path(settings.storage_path)
+
 # Initialize Sentry
 init_sentry()
 
 # Initialize FastAPI app
-app = FastAPI(title="AI Document Summary API", version="1.0.0")
+app = FastAPI(
+    title="AI Document Summary API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse  # orjson encodes job lists and stats far faster than json
+)
 
 # CORS middleware with support for Sentry headers
 app.add_middleware(
@@ -33,12 +65,54 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+@lru_cache(maxsize=1)
+def get_manager() -> AIProviderManager:
+    """One provider manager per API process, shared by every request"""
+    return AIProviderManager()
+
+@lru_cache(maxsize=1)
+def get_stats_cache() -> aioredis.Redis:
+    """Redis client for the /api/stats snapshot written by calculate_system_stats"""
+    return aioredis.from_url(settings.redis_url, socket_connect_timeout=1, socket_timeout=1)
+
+def _save_upload(upload: UploadFile, file_path: str):
+    """Write an upload to file_path, zero-copy when it has already spilled to disk"""
+    source = upload.file
+    with open(file_path, "wb") as buffer:
+        # Small uploads stay in memory inside SpooledTemporaryFile and have no real fd;
+        # only Linux sendfile accepts a regular file as the output (macOS/BSD need a socket)
+        if getattr(source, "_rolled", False) and sys.platform.startswith("linux"):
+            try:
+                source.flush()
+                in_fd = source.fileno()
+                size = os.fstat(in_fd).st_size
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(buffer.fileno(), in_fd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                # e.g. a filesystem without sendfile support; copy from the start instead
+                buffer.seek(0)
+                buffer.truncate()
+        source.seek(0)
+        shutil.copyfileobj(source, buffer)
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
     init_db()
     # Create upload directory if it doesn't exist
-    os.makedirs(settings.storage_path, exist_ok=True)
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if get_manager.cache_info().currsize:
+        await get_manager().aclose()
+    if get_stats_cache.cache_info().currsize:
+        await get_stats_cache().aclose()
 
 # Pydantic models for requests/responses
 class JobCreate(BaseModel):
@@ -46,22 +120,13 @@ class JobCreate(BaseModel):
     ai_provider: AIProviderEnum
     fallback_provider: Optional[AIProviderEnum] = None
 
-class JobResponse(BaseModel):
-    id: int
-    document_id: int
-    status: JobStatus
+class BatchJobCreate(BaseModel):
+    document_ids: List[int]
     ai_provider: AIProviderEnum
-    fallback_provider: Optional[AIProviderEnum]
-    created_at: datetime
-    completed_at: Optional[datetime]
-    summary: Optional[str]
-    key_points: List[str]
-    entities: List[dict]
-    estimated_cost: float
-    actual_cost: float
-    error_message: Optional[str]
 
 class DocumentResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
     id: int
     filename: str
     original_filename: str
@@ -69,6 +134,19 @@ class DocumentResponse(BaseModel):
     file_size: int
     upload_date: datetime
 
+class PresignRequest(BaseModel):
+    filename: str
+    size: int
+
+class PresignResponse(BaseModel):
+    url: str
+    fields: dict
+    key: str
+
+class UploadConfirm(BaseModel):
+    key: str
+    filename: str
+
 class StatsResponse(BaseModel):
     total_jobs: int
     pending_jobs: int
@@ -78,9 +156,23 @@ class StatsResponse(BaseModel):
     total_documents: int
     total_cost: float
     avg_processing_time: float
-    provider_usage: dict
+    provider_usage: dict  # completed jobs per assigned provider
     document_types: dict
 
+def _with_live_counts(stats: StatsResponse, live_counts) -> StatsResponse:
+    """Overlay the Redis job status and provider counters on a possibly older snapshot"""
+    if live_counts is None:
+        return stats
+    counts, provider_usage = live_counts
+    return stats.model_copy(update={
+        "total_jobs": sum(counts.values()),
+        "pending_jobs": counts[JobStatus.PENDING],
+        "processing_jobs": counts[JobStatus.PROCESSING],
+        "completed_jobs": counts[JobStatus.COMPLETED],
+        "failed_jobs": counts[JobStatus.FAILED],
+        "provider_usage": provider_usage,
+    })
+
 class CostEstimate(BaseModel):
     estimated_tokens: int
     estimated_cost: float
@@ -99,18 +191,17 @@ async def upload_document(
     """Upload a document for processing"""
     
     # Validate file size (max 10MB)
-    if file.size > 10 * 1024 * 1024:
+    if file.size > MAX_UPLOAD_SIZE:
         raise HTTPException(status_code=400, detail="File too large (max 10MB)")
     
     # Generate unique filename
     file_ext = os.path.splitext(file.filename)[1]
     unique_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = os.path.join(settings.storage_path, unique_filename)
+    file_path = str(UPLOAD_DIR / unique_filename)
     
     # Save file
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await asyncio.to_thread(_save_upload, file, file_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
     
@@ -130,14 +221,51 @@ async def upload_document(
     db.commit()
     db.refresh(document)
     
-    return DocumentResponse(
-        id=document.id,
-        filename=document.filename,
-        original_filename=document.original_filename,
-        document_type=document.document_type,
-        file_size=document.file_size,
-        upload_date=document.upload_date
+    return document
+
+@app.post("/api/upload/presign", response_model=PresignResponse)
+async def presign_upload(request: PresignRequest):
+    """Return a presigned POST so the client uploads straight to object storage"""
+    
+    if not storage.uses_object_storage():
+        raise HTTPException(status_code=400, detail="Direct uploads require S3 or MinIO storage")
+    
+    if request.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail="File too large (max 10MB)")
+    
+    key = f"{uuid.uuid4()}{os.path.splitext(request.filename)[1]}"
+    presigned = await asyncio.to_thread(storage.presign_upload, key, MAX_UPLOAD_SIZE)
+    return PresignResponse(url=presigned["url"], fields=presigned["fields"], key=key)
+
+@app.post("/api/upload/confirm", response_model=DocumentResponse)
+async def confirm_upload(upload: UploadConfirm, db: Session = Depends(get_db)):
+    """Register a document the client uploaded with /api/upload/presign"""
+    
+    if not storage.uses_object_storage():
+        raise HTTPException(status_code=400, detail="Direct uploads require S3 or MinIO storage")
+    
+    # Keys come from presign_upload and never contain a path
+    if not upload.key or os.path.basename(upload.key) != upload.key:
+        raise HTTPException(status_code=400, detail="Invalid upload key")
+    
+    # Trust the bucket, not the client, for the size
+    file_size = await asyncio.to_thread(storage.object_size, upload.key)
+    if file_size is None:
+        raise HTTPException(status_code=404, detail="Uploaded file not found")
+    
+    document = Document(
+        filename=upload.key,
+        original_filename=upload.filename,
+        document_type=DocumentProcessor.detect_document_type(upload.filename),
+        file_size=file_size,
+        file_path=storage.object_path(upload.key)
     )
+    
+    db.add(document)
+    db.commit()
+    db.refresh(document)
+    
+    return document
 
 @app.post("/api/jobs", response_model=JobResponse)
 async def create_job(
@@ -152,29 +280,18 @@ async def create_job(
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Estimate cost
-    manager = AIProviderManager()
-    try:
-        text, _ = DocumentProcessor.extract_text(document.file_path, document.document_type)
-        estimated_cost = manager.estimate_cost(text, job_data.ai_provider)
-        estimated_tokens = len(text) // 4
-    except:
-        estimated_cost = 0.1  # Default estimate
-        estimated_tokens = 1000
-    
-    # Create job
+    # Create job; process_document fills in the cost estimate once it has extracted the text
     job = Job(
         document_id=job_data.document_id,
         ai_provider=job_data.ai_provider,
         fallback_provider=job_data.fallback_provider,
-        estimated_tokens=estimated_tokens,
-        estimated_cost=estimated_cost,
         is_demo=settings.demo_mode
     )
     
     db.add(job)
     db.commit()
     db.refresh(job)
+    await asyncio.to_thread(stats_counters.record_transition, None, JobStatus.PENDING)
     
     # Queue processing task
     from .tasks import process_document
@@ -188,21 +305,38 @@ async def create_job(
     else:
         process_document.delay(job.id)
     
-    return JobResponse(
-        id=job.id,
-        document_id=job.document_id,
-        status=job.status,
-        ai_provider=job.ai_provider,
-        fallback_provider=job.fallback_provider,
-        created_at=job.created_at,
-        completed_at=job.completed_at,
-        summary=job.summary,
-        key_points=job.key_points or [],
-        entities=job.entities or [],
-        estimated_cost=job.estimated_cost,
-        actual_cost=job.actual_cost,
-        error_message=job.error_message
-    )
+    return job
+
+@app.post("/api/jobs/batch", response_model=List[JobResponse])
+async def create_batch_jobs(job_data: BatchJobCreate, db: Session = Depends(get_db)):
+    """Create jobs summarized through the provider batch API at half price, within 24h"""
+    
+    if settings.demo_mode:
+        raise HTTPException(status_code=403, detail="Batch jobs are not available in demo mode")
+    
+    if job_data.ai_provider not in BATCH_PROVIDERS:
+        raise HTTPException(status_code=400, detail=f"{job_data.ai_provider.value} has no batch API")
+    
+    document_ids = list(dict.fromkeys(job_data.document_ids))
+    if not document_ids or len(document_ids) > MAX_BATCH_JOBS:
+        raise HTTPException(status_code=400, detail=f"document_ids must have between 1 and {MAX_BATCH_JOBS} entries")
+    
+    found = {document_id for (document_id,) in db.query(Document.id).filter(Document.id.in_(document_ids))}
+    if len(found) != len(document_ids):
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    # Not dispatched to process_document: submit_batch_jobs owns these jobs
+    jobs = [Job(document_id=document_id, ai_provider=job_data.ai_provider) for document_id in document_ids]
+    db.add_all(jobs)
+    db.flush()
+    job_ids = [job.id for job in jobs]
+    db.commit()
+    await asyncio.to_thread(stats_counters.record_transition, None, JobStatus.PENDING, len(job_ids))
+    
+    submit_batch_jobs.delay(job_ids)
+    
+    # One SELECT to reload the expired rows for the response
+    return db.query(Job).filter(Job.id.in_(job_ids)).order_by(Job.id).all()
 
 @app.get("/api/jobs/{job_id}", response_model=JobResponse)
 async def get_job(job_id: int, db: Session = Depends(get_db)):
@@ -212,21 +346,11 @@ async def get_job(job_id: int, db: Session = Depends(get_db)):
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return JobResponse(
-        id=job.id,
-        document_id=job.document_id,
-        status=job.status,
-        ai_provider=job.ai_provider,
-        fallback_provider=job.fallback_provider,
-        created_at=job.created_at,
-        completed_at=job.completed_at,
-        summary=job.summary,
-        key_points=job.key_points or [],
-        entities=job.entities or [],
-        estimated_cost=job.estimated_cost,
-        actual_cost=job.actual_cost,
-        error_message=job.error_message
-    )
+    # Finished jobs don't change, so return the body serialized when they finished
+    if job.status in TERMINAL_STATUSES and job.response_json:
+        return Response(content=job.response_json, media_type="application/json")
+    
+    return job
 
 @app.get("/api/jobs", response_model=List[JobResponse])
 async def list_jobs(
@@ -237,6 +361,7 @@ async def list_jobs(
 ):
     """List jobs with optional filtering"""
     
+    # JobResponse has no document fields, so the documents are never loaded
     query = db.query(Job)
     
     if status:
@@ -244,38 +369,43 @@ async def list_jobs(
     
     jobs = query.order_by(Job.created_at.desc()).limit(limit).offset(offset).all()
     
-    return [
-        JobResponse(
-            id=job.id,
-            document_id=job.document_id,
-            status=job.status,
-            ai_provider=job.ai_provider,
-            fallback_provider=job.fallback_provider,
-            created_at=job.created_at,
-            completed_at=job.completed_at,
-            summary=job.summary,
-            key_points=job.key_points or [],
-            entities=job.entities or [],
-            estimated_cost=job.estimated_cost,
-            actual_cost=job.actual_cost,
-            error_message=job.error_message
-        )
-        for job in jobs
-    ]
+    return jobs
 
 @app.get("/api/stats", response_model=StatsResponse)
 async def get_stats(db: Session = Depends(get_db)):
     """Get system statistics"""
     
-    from sqlalchemy import func
     from .models import SystemStats
     
+    # Job status and provider counts are kept live in Redis; None until calculate_system_stats seeds them
+    live_counts = await asyncio.to_thread(stats_counters.read_counts)
+    
+    use_redis = settings.redis_url.startswith("redis://")
+    if use_redis:
+        try:
+            cached = await get_stats_cache().get(STATS_CACHE_KEY)
+        except RedisError:
+            logger.warning("Stats cache read failed", exc_info=True)
+            cached = None
+        if cached:
+            return _with_live_counts(StatsResponse(**json.loads(cached)), live_counts)
+        
+        # Recompute off the request path, at most once per interval however many
+        # requests miss; serve the last snapshot meanwhile
+        try:
+            queue_refresh = await get_stats_cache().set(STATS_REFRESH_KEY, 1, nx=True, ex=settings.stats_min_interval)
+        except RedisError:
+            logger.warning("Stats refresh guard failed", exc_info=True)
+            queue_refresh = False
+        if queue_refresh:
+            calculate_system_stats.delay()
+    
     # Get latest stats or calculate on the fly
     latest_stats = db.query(SystemStats).order_by(SystemStats.timestamp.desc()).first()
     
-    if latest_stats and (datetime.utcnow() - latest_stats.timestamp).seconds < 300:
-        # Use cached stats if less than 5 minutes old
-        return StatsResponse(
+    if latest_stats and (use_redis or (datetime.utcnow() - latest_stats.timestamp).seconds < 300):
+        # Without Redis, use DB-cached stats if less than 5 minutes old
+        return _with_live_counts(StatsResponse(
             total_jobs=latest_stats.total_jobs,
             pending_jobs=latest_stats.pending_jobs,
             processing_jobs=latest_stats.processing_jobs,
@@ -286,78 +416,51 @@ async def get_stats(db: Session = Depends(get_db)):
             avg_processing_time=latest_stats.avg_processing_time,
             provider_usage=latest_stats.provider_usage or {},
             document_types=latest_stats.document_types or {}
-        )
+        ), live_counts)
     
-    # Calculate fresh stats
-    total_jobs = db.query(Job).count()
-    pending_jobs = db.query(Job).filter(Job.status == JobStatus.PENDING).count()
-    processing_jobs = db.query(Job).filter(Job.status == JobStatus.PROCESSING).count()
-    completed_jobs = db.query(Job).filter(Job.status == JobStatus.COMPLETED).count()
-    failed_jobs = db.query(Job).filter(Job.status == JobStatus.FAILED).count()
-    
-    total_documents = db.query(Document).count()
-    total_cost = db.query(func.sum(Job.actual_cost)).scalar() or 0.0
-    avg_time = db.query(func.avg(Job.processing_time)).filter(
-        Job.status == JobStatus.COMPLETED
-    ).scalar() or 0.0
-    
-    # Provider usage
-    provider_usage = {}
-    for provider in AIProviderEnum:
-        count = db.query(Job).filter(Job.ai_provider == provider).count()
-        provider_usage[provider.value] = count
-    
-    # Document types
-    doc_types = {}
-    for doc_type, count in db.query(Document.document_type, func.count()).group_by(Document.document_type):
-        doc_types[doc_type.value if doc_type else "unknown"] = count
-    
-    return StatsResponse(
-        total_jobs=total_jobs,
-        pending_jobs=pending_jobs,
-        processing_jobs=processing_jobs,
-        completed_jobs=completed_jobs,
-        failed_jobs=failed_jobs,
-        total_documents=total_documents,
-        total_cost=total_cost,
-        avg_processing_time=avg_time,
-        provider_usage=provider_usage,
-        document_types=doc_types
-    )
+    # Calculate fresh stats with the same two queries the task uses
+    payload, _ = aggregate_system_stats(db)
+    return _with_live_counts(StatsResponse(**payload), live_counts)
 
 @app.post("/api/estimate-cost", response_model=CostEstimate)
 async def estimate_cost(
     file: UploadFile = File(...),
-    provider: AIProviderEnum = AIProviderEnum.OPENAI_GPT35
+    provider: AIProviderEnum = AIProviderEnum.OPENAI_GPT35,
+    precise: bool = False,
+    manager: AIProviderManager = Depends(get_manager)
 ):
-    """Estimate processing cost for a document"""
+    """Estimate processing cost for a document
     
-    # Save temporary file
-    temp_path = f"/tmp/{uuid.uuid4()}{os.path.splitext(file.filename)[1]}"
+    By default the estimate comes from the file size alone; pass precise=true
+    to extract the text and count it.
+    """
     
-    try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Extract text
-        doc_type = DocumentProcessor.detect_document_type(file.filename)
-        text, _ = DocumentProcessor.extract_text(temp_path, doc_type)
-        
-        # Estimate cost
-        manager = AIProviderManager()
-        estimated_tokens = len(text) // 4
-        estimated_cost = manager.estimate_cost(text, provider)
-        
+    if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=400, detail="File too large (max 10MB)")
+    
+    doc_type = DocumentProcessor.detect_document_type(file.filename)
+    
+    if not precise and file.size is not None:
+        estimated_tokens = DocumentProcessor.estimate_tokens_from_size(file.size, doc_type)
         return CostEstimate(
             estimated_tokens=estimated_tokens,
-            estimated_cost=estimated_cost,
+            estimated_cost=manager.estimate_cost_from_tokens(estimated_tokens, provider),
             provider=provider.value
         )
-        
-    finally:
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+    
+    # Extract text straight from the upload, nothing touches disk
+    data = await file.read()
+    text, _ = await asyncio.to_thread(DocumentProcessor.extract_text_from_bytes, data, doc_type)
+    
+    # Estimate cost
+    estimated_tokens = len(text) // 4
+    estimated_cost = manager.estimate_cost(text, provider)
+    
+    return CostEstimate(
+        estimated_tokens=estimated_tokens,
+        estimated_cost=estimated_cost,
+        provider=provider.value
+    )
 
 @app.post("/api/demo/generate-jobs")
 async def generate_demo_data(count: int = 5):
@@ -366,14 +469,16 @@ async def generate_demo_data(count: int = 5):
     if not settings.demo_mode:
         raise HTTPException(status_code=403, detail="Demo mode is disabled")
     
+    if count < 1 or count > MAX_DEMO_JOBS:
+        raise HTTPException(status_code=400, detail=f"count must be between 1 and {MAX_DEMO_JOBS}")
+    
     result = generate_demo_jobs.delay(count)
     return {"message": f"Generating {count} demo jobs", "task_id": result.id}
 
 @app.get("/api/providers")
-async def list_providers():
+async def list_providers(manager: AIProviderManager = Depends(get_manager)):
     """List available AI providers"""
     
-    manager = AIProviderManager()
     available = manager.get_available_providers()
     
     provider_display_names = {
@@ -399,18 +504,23 @@ async def list_providers():
 async def cancel_job(job_id: int, db: Session = Depends(get_db)):
     """Cancel a pending job"""
     
-    job = db.query(Job).filter(Job.id == job_id).first()
-    if not job:
+    # One atomic UPDATE per cancellable status, so concurrent cancels can't race and
+    # the previous status is known for the stats counters
+    for previous_status in (JobStatus.PENDING, JobStatus.PROCESSING):
+        cancelled = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == previous_status)
+            .values(status=JobStatus.CANCELLED, completed_at=datetime.utcnow())
+            .returning(Job.id)
+        ).scalar()
+        if cancelled:
+            db.commit()
+            await asyncio.to_thread(stats_counters.record_transition, previous_status, JobStatus.CANCELLED)
+            return {"message": "Job cancelled successfully"}
+    
+    if not db.query(Job.id).filter(Job.id == job_id).first():
         raise HTTPException(status_code=404, detail="Job not found")
-    
-    if job.status not in [JobStatus.PENDING, JobStatus.PROCESSING]:
-        raise HTTPException(status_code=400, detail="Job cannot be cancelled")
-    
-    job.status = JobStatus.CANCELLED
-    job.completed_at = datetime.utcnow()
-    db.commit()
-    
-    return {"message": "Job cancelled successfully"}
+    raise HTTPException(status_code=400, detail="Job cannot be cancelled")
 
 if __name__ == "__main__":
     import uvicorn
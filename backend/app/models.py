@@ -1,11 +1,16 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Text, Boolean, JSON, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text, Boolean, JSON, Index, ForeignKey, Enum as SQLEnum
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from datetime import datetime
 import enum
 
 Base = declarative_base()
 
+# Binary JSONB on Postgres (parsed once on write, GIN-indexable); plain JSON elsewhere, e.g. SQLite
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 class JobStatus(str, enum.Enum):
     PENDING = "pending"
     PROCESSING = "processing"
@@ -32,30 +37,40 @@ class Document(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, nullable=False)
     original_filename = Column(String, nullable=False)
-    document_type = Column(SQLEnum(DocumentType), default=DocumentType.UNKNOWN)
+    document_type = Column(SQLEnum(DocumentType), default=DocumentType.UNKNOWN, index=True)
     file_size = Column(Integer)  # in bytes
     file_path = Column(String)
     upload_date = Column(DateTime, default=func.now())
     user_id = Column(String, nullable=True)
-    doc_metadata = Column(JSON, default={})
+    doc_metadata = Column(JSONType, default=dict)
     
 class Job(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        # Covers the per-status and per-provider counts behind /api/stats
+        Index("ix_jobs_status_provider", "status", "ai_provider"),
+        # Range scan for cleanup_old_jobs (status = X AND completed_at < cutoff)
+        Index("ix_jobs_status_completed_at", "status", "completed_at"),
+        # Containment lookups such as "jobs mentioning entity X"
+        Index("ix_jobs_entities_gin", "entities", postgresql_using="gin"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(Integer, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), index=True)
     status = Column(SQLEnum(JobStatus), default=JobStatus.PENDING, index=True)
-    ai_provider = Column(SQLEnum(AIProvider))
+    ai_provider = Column(SQLEnum(AIProvider), index=True)
     fallback_provider = Column(SQLEnum(AIProvider), nullable=True)
     created_at = Column(DateTime, default=func.now())
     started_at = Column(DateTime, nullable=True)
     completed_at = Column(DateTime, nullable=True)
     processing_time = Column(Float, nullable=True)  # in seconds
     
+    document = relationship("Document")
+    
     # Summary results
     summary = Column(Text, nullable=True)
-    key_points = Column(JSON, default=[])
-    entities = Column(JSON, default=[])
+    key_points = Column(JSONType, default=list)
+    entities = Column(JSONType, default=list)
     
     # Cost tracking
     estimated_tokens = Column(Integer, default=0)
@@ -63,6 +78,15 @@ class Job(Base):
     estimated_cost = Column(Float, default=0.0)
     actual_cost = Column(Float, default=0.0)
     
+    # Set when only the first ai_max_map_chunks chunks were summarized
+    truncated = Column(Boolean, default=False)
+    
+    # Provider batch holding the job's current batch request (POST /api/jobs/batch only)
+    batch_id = Column(String, nullable=True)
+    
+    # Serialized JobResponse, written once the job reaches a terminal status
+    response_json = Column(Text, nullable=True)
+    
     # Error handling
     error_message = Column(Text, nullable=True)
     retry_count = Column(Integer, default=0)
@@ -87,6 +111,6 @@ class SystemStats(Base):
     total_cost = Column(Float, default=0.0)
     avg_processing_time = Column(Float, default=0.0)
     
-    provider_usage = Column(JSON, default={})  # {provider: count}
-    document_types = Column(JSON, default={})  # {type: count}
-    hourly_stats = Column(JSON, default={})  # hourly breakdown
\ No newline at end of file
+    provider_usage = Column(JSONType, default=dict)  # {provider: count}
+    document_types = Column(JSONType, default=dict)  # {type: count}
+    hourly_stats = Column(JSONType, default=dict)  # hourly breakdown
\ No newline at end of file
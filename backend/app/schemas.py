@@ -0,0 +1,47 @@
+from pydantic import BaseModel, ConfigDict, field_validator
+from typing import Any, List, Mapping, Optional, Union
+from datetime import datetime
+import orjson
+from .models import Job, JobStatus, AIProvider as AIProviderEnum
+
+# Statuses after which a job's response never changes
+TERMINAL_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED)
+
+class JobResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    
+    id: int
+    document_id: int
+    status: JobStatus
+    ai_provider: AIProviderEnum
+    fallback_provider: Optional[AIProviderEnum]
+    created_at: datetime
+    completed_at: Optional[datetime]
+    summary: Optional[str]
+    key_points: List[str]
+    entities: List[dict]
+    estimated_cost: float
+    actual_cost: float
+    truncated: bool = False
+    error_message: Optional[str]
+    
+    @field_validator("key_points", "entities", mode="before")
+    @classmethod
+    def _default_empty(cls, value):
+        return value or []
+    
+    @field_validator("truncated", mode="before")
+    @classmethod
+    def _default_false(cls, value):
+        return bool(value)
+
+def job_response_json(job: Union[Job, Mapping[str, Any]], **changes) -> str:
+    """Serialize a finished job once so GET /api/jobs/{id} can return it as-is
+
+    job may also be a mapping of column values, for callers holding no loaded row;
+    changes overrides column values that are written without going through the ORM object.
+    """
+    response = JobResponse.model_validate(job).model_copy(
+        update={k: v for k, v in changes.items() if k in JobResponse.model_fields}
+    )
+    return orjson.dumps(response.model_dump(mode="json")).decode()
\ No newline at end of file
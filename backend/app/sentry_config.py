@@ -6,8 +6,19 @@ from sentry_sdk.integrations.redis import RedisIntegration
 from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from sentry_sdk.integrations.logging import LoggingIntegration
 import logging
+import re
 from .config import settings
 
+# Built once; before_send_filter runs on every event
+_SENSITIVE_HEADERS = frozenset({'authorization', 'cookie', 'x-api-key', 'x-auth-token'})
+_SENSITIVE_KEY_RE = re.compile(r'password|secret|token|api_key|private_key', re.IGNORECASE)
+
+def _sample_rate(configured):
+    """Full sampling while developing, a production-safe 5% otherwise"""
+    if configured is not None:
+        return configured
+    return 1.0 if settings.environment == "development" else 0.05
+
 def init_sentry():
     """Initialize Sentry with all integrations"""
     
@@ -43,8 +54,8 @@ def init_sentry():
         ],
         
         # Performance Monitoring
-        traces_sample_rate=1.0,  # Capture 100% of transactions for performance monitoring
-        profiles_sample_rate=1.0,  # Profile 100% of sampled transactions
+        traces_sample_rate=_sample_rate(settings.sentry_traces_sample_rate),
+        profiles_sample_rate=_sample_rate(settings.sentry_profiles_sample_rate),  # Of sampled transactions
         
         # Session tracking
         release=settings.app_version if hasattr(settings, 'app_version') else "ai-doc-summary@1.0.0",
@@ -65,16 +76,16 @@ def before_send_filter(event, hint):
     
     # Remove sensitive headers
     if 'request' in event and 'headers' in event['request']:
-        sensitive_headers = ['authorization', 'cookie', 'x-api-key', 'x-auth-token']
-        for header in sensitive_headers:
-            if header in event['request']['headers']:
-                event['request']['headers'][header] = '[FILTERED]'
+        headers = event['request']['headers']
+        for header in headers:
+            if header.lower() in _SENSITIVE_HEADERS:
+                headers[header] = '[FILTERED]'
     
     # Remove sensitive data from extra context
     if 'extra' in event:
-        sensitive_keys = ['password', 'secret', 'token', 'api_key', 'private_key']
-        for key in list(event['extra'].keys()):
-            if any(sensitive in key.lower() for sensitive in sensitive_keys):
-                event['extra'][key] = '[FILTERED]'
+        extra = event['extra']
+        for key in extra:
+            if _SENSITIVE_KEY_RE.search(key):
+                extra[key] = '[FILTERED]'
     
     return event
\ No newline at end of file
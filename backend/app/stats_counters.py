@@ -0,0 +1,112 @@
+import logging
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+import redis
+from redis.exceptions import RedisError
+from .config import settings
+from .models import JobStatus, AIProvider as AIProviderEnum
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "stats:jobs:"
+# Set only by reset_status_counts; INCRBY creates status keys before any seed
+SEEDED_KEY = f"{KEY_PREFIX}seeded"
+# Completed jobs per assigned provider, the live side of provider_usage
+PROVIDER_KEY_PREFIX = "stats:provider:"
+
+def status_key(status: JobStatus) -> str:
+    return f"{KEY_PREFIX}{status.value}"
+
+def provider_key(provider: AIProviderEnum) -> str:
+    return f"{PROVIDER_KEY_PREFIX}{provider.value}"
+
+@lru_cache(maxsize=1)
+def get_client() -> Optional[redis.Redis]:
+    """Sync Redis client shared by the counters and the worker caches; None without Redis"""
+    if not settings.redis_url.startswith("redis://"):
+        return None
+    return redis.Redis.from_url(settings.redis_url, socket_connect_timeout=1, socket_timeout=1)
+
+def record_transitions(transitions: Iterable[tuple], completed_providers: Iterable[AIProviderEnum] = ()):
+    """Apply committed (old_status, new_status) moves; old_status is None for new jobs
+    and new_status is None for deleted ones. completed_providers holds the provider
+    of each job that moved to COMPLETED.
+
+    Counters are best-effort; calculate_system_stats resets them from the
+    database, so a lost update only lasts until its next run.
+    """
+    client = get_client()
+    if client is None:
+        return
+
+    deltas = Counter()
+    for old, new in transitions:
+        if old == new:
+            continue
+        if old is not None:
+            deltas[old] -= 1
+        if new is not None:
+            deltas[new] += 1
+    provider_deltas = Counter(completed_providers)
+
+    # MULTI/EXEC: a job moving between statuses is never seen counted twice or not at all
+    try:
+        pipe = client.pipeline(transaction=True)
+        for status, delta in deltas.items():
+            if delta:
+                pipe.incrby(status_key(status), delta)
+        for provider, delta in provider_deltas.items():
+            pipe.incrby(provider_key(provider), delta)
+        pipe.execute()
+    except RedisError:
+        logger.warning("Job status counter update failed", exc_info=True)
+
+def record_transition(
+    old: Optional[JobStatus],
+    new: Optional[JobStatus],
+    count: int = 1,
+    provider: Optional[AIProviderEnum] = None
+):
+    """provider is credited for each job when new is COMPLETED"""
+    completed = [provider] * count if provider is not None and new == JobStatus.COMPLETED else []
+    record_transitions([(old, new)] * count, completed)
+
+def read_counts() -> Optional[Tuple[Dict[JobStatus, int], Dict[str, int]]]:
+    """Status counters and completed jobs per provider value, or None until they have been seeded"""
+    client = get_client()
+    if client is None:
+        return None
+
+    try:
+        seeded, *values = client.mget(
+            [SEEDED_KEY]
+            + [status_key(status) for status in JobStatus]
+            + [provider_key(provider) for provider in AIProviderEnum]
+        )
+    except RedisError:
+        logger.warning("Job status counter read failed", exc_info=True)
+        return None
+    if seeded is None:
+        return None
+    status_values, provider_values = values[:len(JobStatus)], values[len(JobStatus):]
+    return (
+        {status: int(value or 0) for status, value in zip(JobStatus, status_values)},
+        {provider.value: int(value or 0) for provider, value in zip(AIProviderEnum, provider_values)}
+    )
+
+def reset_status_counts(counts: Dict[JobStatus, int], provider_counts: Dict[str, int]):
+    """Overwrite the counters with authoritative counts from the database;
+    provider_counts is keyed by provider value"""
+    client = get_client()
+    if client is None:
+        return
+
+    try:
+        client.mset({
+            **{status_key(status): counts.get(status, 0) for status in JobStatus},
+            **{provider_key(provider): provider_counts.get(provider.value, 0) for provider in AIProviderEnum},
+            SEEDED_KEY: 1
+        })
+    except RedisError:
+        logger.warning("Job status counter reset failed", exc_info=True)
\ No newline at end of file
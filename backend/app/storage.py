@@ -0,0 +1,55 @@
+import os
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import boto3
+from botocore.exceptions import ClientError
+from .config import settings
+
+S3_SCHEME = "s3://"
+PRESIGN_EXPIRES = 3600  # seconds a presigned upload stays valid
+
+def uses_object_storage() -> bool:
+    return settings.storage_type in ("s3", "minio")
+
+@lru_cache(maxsize=1)
+def get_s3_client():
+    """S3 client for the configured bucket; MinIO is reached through aws_s3_endpoint_url"""
+    return boto3.client(
+        "s3",
+        region_name=settings.aws_region,
+        aws_access_key_id=settings.aws_access_key_id,
+        aws_secret_access_key=settings.aws_secret_access_key,
+        endpoint_url=settings.aws_s3_endpoint_url,
+    )
+
+def presign_upload(key: str, max_size: int) -> Dict[str, Any]:
+    """Presigned POST the client uses to upload straight to the bucket"""
+    return get_s3_client().generate_presigned_post(
+        Bucket=settings.aws_s3_bucket,
+        Key=key,
+        Conditions=[["content-length-range", 1, max_size]],
+        ExpiresIn=PRESIGN_EXPIRES,
+    )
+
+def object_size(key: str) -> Optional[int]:
+    """Size of an uploaded object, or None if it doesn't exist"""
+    try:
+        head = get_s3_client().head_object(Bucket=settings.aws_s3_bucket, Key=key)
+    except ClientError:
+        return None
+    return head["ContentLength"]
+
+def object_path(key: str) -> str:
+    return f"{S3_SCHEME}{settings.aws_s3_bucket}/{key}"
+
+def local_path(file_path: str) -> str:
+    """Return a local path for a document, downloading it once if it lives in the bucket"""
+    if not file_path or not file_path.startswith(S3_SCHEME):
+        return file_path
+
+    bucket, key = file_path[len(S3_SCHEME):].split("/", 1)
+    path = os.path.join(settings.storage_path, key)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        get_s3_client().download_file(bucket, key, path)
+    return path
\ No newline at end of file
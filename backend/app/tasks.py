@@ -1,16 +1,111 @@
-from celery import Task
+from celery import Task, group
+from celery.signals import worker_process_init
 from .celery_app import celery_app
 from .database import SessionLocal
-from .models import Job, Document, JobStatus, AIProvider as AIProviderEnum
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import joinedload
+from .models import Job, Document, JobStatus, DocumentType, AIProvider as AIProviderEnum
 from .ai_providers.manager import AIProviderManager
+from .ai_providers.base import MAX_REDUCE_ROUNDS
 from .document_processor import DocumentProcessor
+from . import storage
+from . import stats_counters
+from . import worker_loop
+from .schemas import job_response_json
+from .config import settings
 from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Tuple
 import random
-import asyncio
+import json
+import logging
+import msgpack
+import os
 import time
+from redis.exceptions import RedisError
 import sentry_sdk
 from sentry_sdk import start_span, set_context, get_current_span
 
+logger = logging.getLogger(__name__)
+
+# Redis key holding the latest /api/stats payload
+STATS_CACHE_KEY = "stats:latest"
+# Set with NX by /api/stats so one cache miss per interval queues a refresh
+STATS_REFRESH_KEY = "stats:refresh"
+CLEANUP_BATCH_SIZE = 1000  # rows per cleanup DELETE
+# Extracted (text, page_count) by document type and file content hash
+EXTRACT_CACHE_PREFIX = "extract:"
+
+def _extract_document_text(document: Document):
+    """Extract a document's text once and reuse it across jobs and retries
+    
+    The text is kept in a sidecar file next to the upload; its path and the
+    page count are recorded in doc_metadata and saved by the caller's commit.
+    Other documents with the same file content hit a Redis copy keyed by its hash.
+    """
+    metadata = document.doc_metadata or {}
+    text_path = metadata.get("extracted_text_path")
+    if text_path and os.path.exists(text_path):
+        with open(text_path, "r", encoding="utf-8") as f:
+            return f.read(), metadata.get("page_count")
+    
+    # Presigned uploads live in the bucket; extraction needs a local copy
+    file_path = storage.local_path(document.file_path)
+    has_file = bool(file_path) and os.path.exists(file_path)
+    
+    # Re-uploads of the same file reuse the text extracted from the first copy
+    cache_key = None
+    cached = None
+    client = stats_counters.get_client()
+    if has_file and client is not None:
+        cache_key = f"{EXTRACT_CACHE_PREFIX}{(document.document_type or DocumentType.UNKNOWN).value}:{DocumentProcessor.file_hash(file_path)}"
+        try:
+            cached = client.get(cache_key)
+        except RedisError:
+            logger.warning("Extraction cache read failed", exc_info=True)
+    
+    span = get_current_span()
+    if span:
+        span.set_data("cache.hit", cached is not None)
+    
+    if cached is not None:
+        text, page_count = msgpack.unpackb(cached)
+    else:
+        text, page_count = DocumentProcessor.extract_text(file_path, document.document_type)
+        if text and cache_key is not None:
+            try:
+                client.set(cache_key, msgpack.packb((text, page_count)), ex=settings.extract_cache_ttl)
+            except RedisError:
+                logger.warning("Extraction cache write failed", exc_info=True)
+    
+    # Demo documents may have no file on disk; there is nothing to sit next to
+    if text and has_file:
+        text_path = f"{file_path}.txt"
+        try:
+            with open(text_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            document.doc_metadata = {**metadata, "extracted_text_path": text_path, "page_count": page_count}
+        except OSError:
+            logger.warning("Could not cache extracted text for document %s", document.id, exc_info=True)
+    
+    return text, page_count
+
+@lru_cache(maxsize=1)
+def get_manager() -> AIProviderManager:
+    """One provider manager per worker process, so every task reuses its connection pools"""
+    return AIProviderManager()
+
+@worker_process_init.connect
+def _reset_manager(**kwargs):
+    # Pools built in a prefork parent belong to the parent's event loop
+    get_manager.cache_clear()
+
+def _set_span_data(span, data: dict):
+    # Unsampled spans are never sent, so their data isn't worth recording
+    if span and span.sampled:
+        for key, value in data.items():
+            span.set_data(key, value)
+
 class CallbackTask(Task):
     def on_success(self, retval, task_id, args, kwargs):
         """Success handler"""
@@ -20,119 +115,174 @@ class CallbackTask(Task):
         """Error handler"""
         pass
 
-@celery_app.task(base=CallbackTask, bind=True, max_retries=3)
+@celery_app.task(base=CallbackTask, bind=True, max_retries=3, acks_late=True)
 def process_document(self=None, job_id: int=None):
     """Main task to process a document and generate summary"""
 
-    # Get the current span (transaction created by CeleryIntegration)
+    # The transaction created by CeleryIntegration; looked up once and reused
     current_span = get_current_span()
-    if current_span:
-        # Set data attributes
-        current_span.set_data("job.id", int(job_id))
-        current_span.set_data("task.name", "process_document")
+    _set_span_data(current_span, {"job.id": int(job_id), "task.name": "process_document"})
 
     db = SessionLocal()
+    # Job status as last committed, for the stats counters
+    committed_status = None
     try:
         # Get job and document
         with start_span(op="db.query", description="Fetch job and document"):
-            job = db.query(Job).filter(Job.id == job_id).first()
+            # One SELECT for both rows
+            job = db.query(Job).options(joinedload(Job.document)).filter(Job.id == job_id).first()
             if not job:
                 raise ValueError(f"Job {job_id} not found")
 
-            document = db.query(Document).filter(Document.id == job.document_id).first()
+            committed_status = job.status
+            # Cancelled, finished or batch-submitted jobs; a PROCESSING job is only picked
+            # up again when its message was redelivered after the worker was lost
+            redelivered = bool(self and (self.request.delivery_info or {}).get("redelivered"))
+            if job.status != JobStatus.PENDING and not (redelivered and job.status == JobStatus.PROCESSING):
+                return {"job_id": job_id, "status": "skipped"}
+
+            document = job.document
             if not document:
                 raise ValueError(f"Document {job.document_id} not found")
 
-        # Set document and provider data on transaction
-        current_span = get_current_span()
-        if current_span:
-            current_span.set_data("document.id", int(document.id))
-            current_span.set_data("document.type", str(document.document_type))
-            current_span.set_data("ai.provider", str(job.ai_provider))
-            if job.fallback_provider:
-                current_span.set_data("ai.fallback_provider", str(job.fallback_provider))
-            current_span.set_data("job.is_demo", bool(job.is_demo))
-            current_span.set_data("job.retry_count", int(job.retry_count))
-
-        # Set span attributes on the transaction for metrics
-        current_span = get_current_span()
-        if current_span:
-            current_span.set_data("document.size", int(document.file_size) if document.file_size is not None else 0)
-            current_span.set_data("document.id", int(document.id))
-            current_span.set_data("document.type", str(document.document_type))
-            current_span.set_data("ai.provider", str(job.ai_provider))
-            current_span.set_data("ai.cost.estimated", float(job.estimated_cost) if job.estimated_cost is not None else 0.0)
-            current_span.set_data("ai.tokens.estimated", int(job.estimated_tokens) if job.estimated_tokens is not None else 0)
-            current_span.set_data("job.is_demo", bool(job.is_demo))
-            current_span.set_data("job.retry_count", int(job.retry_count))  # Add retry count to span data
-
-        # Update job status
-        with start_span(op="db.update", description="Update job status to processing"):
-            job.status = JobStatus.PROCESSING
-            job.started_at = datetime.utcnow()
-            db.commit()
+        # Child spans inherit the decision, so nothing below is recorded for the job
+        if job.is_demo and not settings.sentry_trace_demo_jobs and current_span is not None:
+            current_span.sampled = False
+
+        # Document, provider and estimate data on the transaction for metrics
+        transaction_data = {
+            "document.id": int(document.id),
+            "document.type": str(document.document_type),
+            "document.size": int(document.file_size) if document.file_size is not None else 0,
+            "ai.provider": str(job.ai_provider),
+            "ai.cost.estimated": float(job.estimated_cost) if job.estimated_cost is not None else 0.0,
+            "ai.tokens.estimated": int(job.estimated_tokens) if job.estimated_tokens is not None else 0,
+            "job.is_demo": bool(job.is_demo),
+            "job.retry_count": int(job.retry_count),
+        }
+        if job.fallback_provider:
+            transaction_data["ai.fallback_provider"] = str(job.fallback_provider)
+        _set_span_data(current_span, transaction_data)
+
+        # Written with the estimate below, by a conditional UPDATE
+        started_at = datetime.utcnow()
+
+        # Open the provider connection on the worker loop while this task parses the file
+        manager = get_manager()
+        if not job.is_demo:
+            worker_loop.submit(manager.preconnect(job.ai_provider))
 
         # Extract text from document
         with start_span(op="document.extract", description="Extract text from document") as extract_span:
-            text, page_count = DocumentProcessor.extract_text(
-                document.file_path,
-                document.document_type
-            )
+            text, page_count = _extract_document_text(document)
 
             if not text:
                 raise ValueError("No text could be extracted from document")
 
-            # Use set_data for span-specific data
-            extract_span.set_data("text.length", int(len(text)))
-            extract_span.set_data("text.estimated_tokens", int(len(text) // 4))
-            extract_span.set_data("document.pages", int(page_count) if page_count is not None else 0)
-            extract_span.set_data("document.id", int(document.id))
-            extract_span.set_data("document.type", str(document.document_type))
-            extract_span.set_data("document.size", int(document.file_size) if document.file_size is not None else 0)
+            text_len = len(text)
 
-        # Initialize AI provider manager
-        manager = AIProviderManager()
+            # Use set_data for span-specific data
+            _set_span_data(extract_span, {
+                "text.length": text_len,
+                "text.estimated_tokens": text_len // 4,
+                "document.pages": int(page_count) if page_count is not None else 0,
+                "document.id": int(document.id),
+                "document.type": str(document.document_type),
+                "document.size": int(document.file_size) if document.file_size is not None else 0,
+            })
+
+        # Everything the AI phase reads, taken before the commit expires the rows: touching
+        # an expired attribute would check a connection out and hold it through the LLM call
+        ai_provider = job.ai_provider
+        fallback_provider = job.fallback_provider
+        created_at = job.created_at
+        error_message = job.error_message
+        is_demo = job.is_demo
+        estimated_tokens = job.estimated_tokens
+        estimated_cost = job.estimated_cost
+        document_id = document.id
+        document_type = document.document_type
+        document_size = document.file_size
+
+        # Estimate cost from the extracted text (not done in the API request)
+        if not estimated_tokens:
+            with start_span(op="ai.estimate", description="Estimate job cost"):
+                estimated_tokens = text_len // 4
+                estimated_cost = manager.estimate_cost(text, ai_provider)
+
+            _set_span_data(current_span, {
+                "ai.cost.estimated": float(estimated_cost),
+                "ai.tokens.estimated": int(estimated_tokens),
+            })
+
+        # One commit for the PROCESSING transition, the estimate and the cached-text
+        # metadata; it lands before the long AI call so the API shows the job as processing.
+        # Conditional, so a cancel committed during extraction is not overwritten
+        with start_span(op="db.update", description="Update job status to processing"):
+            started = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == committed_status)
+                .values(
+                    status=JobStatus.PROCESSING,
+                    started_at=started_at,
+                    estimated_tokens=estimated_tokens,
+                    estimated_cost=estimated_cost
+                )
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+            if not started:
+                return {"job_id": job_id, "status": "skipped"}
+            stats_counters.record_transition(committed_status, JobStatus.PROCESSING)
+            committed_status = JobStatus.PROCESSING
 
         # Run async summarization
         with start_span(op="ai.summarize", description="AI summarization") as ai_span:
             try:
-                # Set data before processing
-                ai_span.set_data("ai.provider.primary", str(job.ai_provider))
-                ai_span.set_data("ai.provider.fallback", str(job.fallback_provider) if job.fallback_provider else "none")
-                ai_span.set_data("ai.cost.estimated", float(job.estimated_cost) if job.estimated_cost is not None else 0.0)
-                ai_span.set_data("ai.tokens.estimated", int(job.estimated_tokens) if job.estimated_tokens is not None else 0)
-                ai_span.set_data("ai.demo_mode", bool(job.is_demo))
-                # Also set document size on AI span for aggregation
-                ai_span.set_data("document.size", int(document.file_size) if document.file_size is not None else 0)
-                ai_span.set_data("document.id", int(document.id))
-
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-
-                try:
-                    result = loop.run_until_complete(
-                        manager.summarize_with_fallback(
-                            text,
-                            job.ai_provider,
-                            job.fallback_provider,
-                            demo_mode=job.is_demo
-                        )
+                # Set data before processing; document size is repeated here for aggregation
+                _set_span_data(ai_span, {
+                    "ai.provider.primary": str(ai_provider),
+                    "ai.provider.fallback": str(fallback_provider) if fallback_provider else "none",
+                    "ai.cost.estimated": float(estimated_cost) if estimated_cost is not None else 0.0,
+                    "ai.tokens.estimated": int(estimated_tokens) if estimated_tokens is not None else 0,
+                    "ai.demo_mode": bool(is_demo),
+                    "document.size": int(document_size) if document_size is not None else 0,
+                    "document.id": int(document_id),
+                })
+
+                result = worker_loop.run(
+                    manager.summarize_with_fallback(
+                        text,
+                        ai_provider,
+                        fallback_provider,
+                        demo_mode=is_demo
                     )
-                finally:
-                    loop.close()
+                )
+
+                provider_used = str(result.provider_used)
+                tokens_actual = int(result.tokens_used) if result.tokens_used is not None else 0
+                cost_actual = float(result.cost) if result.cost is not None else 0.0
+                summary_len = len(result.summary) if result.summary else 0
+                key_points_count = len(result.key_points) if result.key_points else 0
+                entities_count = len(result.entities) if result.entities else 0
 
                 # Set AI processing result data
-                ai_span.set_data("ai.tokens.actual", int(result.tokens_used) if result.tokens_used is not None else 0)
-                ai_span.set_data("ai.cost.actual", float(result.cost) if result.cost is not None else 0.0)
-                ai_span.set_data("ai.provider.used", str(result.provider_used))
-                ai_span.set_data("ai.summary.length", int(len(result.summary)) if result.summary else 0)
-                ai_span.set_data("ai.key_points.count", int(len(result.key_points)) if result.key_points else 0)
-                ai_span.set_data("ai.entities.count", int(len(result.entities)) if result.entities else 0)
+                ai_span.set_tag("cache.hit", "exact" if result.cached else "miss")
+                result_data = {
+                    "ai.tokens.actual": tokens_actual,
+                    "ai.cost.actual": cost_actual,
+                    "ai.provider.used": provider_used,
+                    "ai.summary.length": summary_len,
+                    "ai.key_points.count": key_points_count,
+                    "ai.entities.count": entities_count,
+                    "ai.input.truncated": bool(result.truncated),
+                }
 
                 # Calculate cost savings
-                if job.estimated_cost:
-                    ai_span.set_data("ai.cost.savings", float(job.estimated_cost - result.cost))
-                    ai_span.set_data("ai.cost.savings_percent", float(((job.estimated_cost - result.cost) / job.estimated_cost) * 100))
+                if estimated_cost:
+                    result_data["ai.cost.savings"] = float(estimated_cost - result.cost)
+                    result_data["ai.cost.savings_percent"] = float(((estimated_cost - result.cost) / estimated_cost) * 100)
+                _set_span_data(ai_span, result_data)
             except Exception as e:
                 # Capture exception within AI span context
                 ai_span.set_data("error.type", type(e).__name__)
@@ -140,78 +290,98 @@ def process_document(self=None, job_id: int=None):
                 sentry_sdk.capture_exception(e)
                 raise
 
-        # Update job with results
+        # Update job with results; a Core UPDATE skips the unit-of-work flush
         with start_span(op="db.update", description="Save job results") as update_span:
-            job.summary = result.summary
-            job.key_points = result.key_points
-            job.entities = result.entities
-            job.actual_tokens = result.tokens_used
-            job.actual_cost = result.cost
-            job.status = JobStatus.COMPLETED
-            job.completed_at = datetime.utcnow()
-            job.processing_time = (job.completed_at - job.started_at).total_seconds()
+            completed_at = datetime.utcnow()
+            processing_time = (completed_at - started_at).total_seconds()
+            results = {
+                "summary": result.summary,
+                "key_points": result.key_points,
+                "entities": result.entities,
+                "actual_tokens": result.tokens_used,
+                "actual_cost": result.cost,
+                "truncated": result.truncated,
+                "status": JobStatus.COMPLETED,
+                "completed_at": completed_at,
+                "processing_time": processing_time,
+            }
 
-            # Add data to the update span
-            update_span.set_data("job.id", int(job_id))
-            update_span.set_data("job.final_status", "completed")
-            update_span.set_data("job.processing_time_seconds", float(job.processing_time))
+            # The response snapshot comes from values captured before the commit expired
+            # the row, so serializing it doesn't reload the job
+            snapshot = {
+                "id": job_id,
+                "document_id": document_id,
+                "ai_provider": ai_provider,
+                "fallback_provider": fallback_provider,
+                "created_at": created_at,
+                "estimated_cost": estimated_cost,
+                "error_message": error_message,
+            }
 
+            # Add data to the update span
+            _set_span_data(update_span, {
+                "job.id": int(job_id),
+                "job.final_status": "completed",
+                "job.processing_time_seconds": float(processing_time),
+            })
+
+            # Conditional, so a job cancelled during the AI call stays cancelled and is counted once
+            completed = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == JobStatus.PROCESSING)
+                .values(**results, response_json=job_response_json({**snapshot, **results}))
+                .execution_options(synchronize_session=False)
+            ).rowcount
             db.commit()
-
-        # Set final transaction data
-        current_span = get_current_span()
-        if current_span:
-            current_span.set_data("job.status", "completed")
-            current_span.set_data("ai.provider.final", str(result.provider_used))
-
-        # Update transaction span attributes with final metrics
-        current_span = get_current_span()
-        if current_span:
-            current_span.set_data("ai.tokens.actual", int(result.tokens_used) if result.tokens_used is not None else 0)
-            current_span.set_data("ai.cost.actual", float(result.cost) if result.cost is not None else 0.0)
-            current_span.set_data("ai.provider.used", str(result.provider_used))
-            current_span.set_data("job.processing_time", float(job.processing_time) if job.processing_time else 0.0)
-            current_span.set_data("job.status", "completed")
-
-        # Set data on the transaction for detailed view
-        current_span = get_current_span()
-        if current_span:
-            current_span.set_data("job.id", job_id)
-            current_span.set_data("job.tokens.total", result.tokens_used)
-            current_span.set_data("job.cost.total", result.cost)
-            current_span.set_data("job.processing_time_seconds", job.processing_time)
-            current_span.set_data("job.document.type", document.document_type)
-            current_span.set_data("job.document.size_bytes", document.file_size)
-            if job.estimated_cost:
-                current_span.set_data("job.cost.savings", job.estimated_cost - result.cost)
-
-        # Set detailed context for Sentry
-        set_context("job_metrics", {
-            "job_id": job_id,
-            "provider_used": result.provider_used,
-            "tokens": {
-                "estimated": job.estimated_tokens,
-                "actual": result.tokens_used,
-                "difference": job.estimated_tokens - result.tokens_used if job.estimated_tokens else 0
-            },
-            "cost": {
-                "estimated": job.estimated_cost,
-                "actual": result.cost,
-                "savings": job.estimated_cost - result.cost if job.estimated_cost else 0
-            },
-            "document": {
-                "type": document.document_type,
-                "size_bytes": document.file_size,
-                "text_length": len(text),
-                "pages": page_count
-            },
-            "processing": {
-                "time_seconds": job.processing_time,
-                "summary_length": len(result.summary) if result.summary else 0,
-                "key_points_count": len(result.key_points) if result.key_points else 0,
-                "entities_count": len(result.entities) if result.entities else 0
+            if completed:
+                stats_counters.record_transition(JobStatus.PROCESSING, JobStatus.COMPLETED, provider=ai_provider)
+
+        # Final metrics and context are only built for transactions Sentry keeps
+        if current_span is not None and current_span.sampled:
+            final_data = {
+                "job.status": "completed",
+                "ai.provider.final": provider_used,
+                "ai.provider.used": provider_used,
+                "ai.tokens.actual": tokens_actual,
+                "ai.cost.actual": cost_actual,
+                "job.processing_time": float(processing_time) if processing_time else 0.0,
+                "job.tokens.total": result.tokens_used,
+                "job.cost.total": result.cost,
+                "job.processing_time_seconds": processing_time,
+                "job.document.type": document_type,
+                "job.document.size_bytes": document_size,
             }
-        })
+            if estimated_cost:
+                final_data["job.cost.savings"] = estimated_cost - result.cost
+            _set_span_data(current_span, final_data)
+
+            # Set detailed context for Sentry
+            set_context("job_metrics", {
+                "job_id": job_id,
+                "provider_used": result.provider_used,
+                "tokens": {
+                    "estimated": estimated_tokens,
+                    "actual": result.tokens_used,
+                    "difference": estimated_tokens - result.tokens_used if estimated_tokens else 0
+                },
+                "cost": {
+                    "estimated": estimated_cost,
+                    "actual": result.cost,
+                    "savings": estimated_cost - result.cost if estimated_cost else 0
+                },
+                "document": {
+                    "type": document_type,
+                    "size_bytes": document_size,
+                    "text_length": text_len,
+                    "pages": page_count
+                },
+                "processing": {
+                    "time_seconds": processing_time,
+                    "summary_length": summary_len,
+                    "key_points_count": key_points_count,
+                    "entities_count": entities_count
+                }
+            })
 
         return {
             "job_id": job_id,
@@ -226,39 +396,274 @@ def process_document(self=None, job_id: int=None):
         sentry_sdk.capture_exception(e)
 
         # Set error data on transaction
-        current_span = get_current_span()
-        if current_span:
-            current_span.set_data("job.status", "failed")
-            current_span.set_data("error.type", type(e).__name__)
-            current_span.set_data("error.message", str(e))
-            current_span.set_data("job.id", int(job_id))
+        _set_span_data(current_span, {
+            "job.status": "failed",
+            "error.type": type(e).__name__,
+            "error.message": str(e),
+        })
 
         # Handle failure
         if job:
-            job.status = JobStatus.FAILED
-            job.error_message = str(e)
-            job.retry_count += 1
+            # Drop uncommitted changes; the row is only moved if it still has its last
+            # committed status, so a concurrent cancel wins and is counted once
+            db.rollback()
+            retry_count = job.retry_count + 1
 
             # Update Sentry span with actual retry count after increment
-            current_span = get_current_span()
-            if current_span:
-                current_span.set_data("job.retry_count", int(job.retry_count))
+            _set_span_data(current_span, {"job.retry_count": int(retry_count)})
 
             # Retry if under max retries
-            if job.retry_count < job.max_retries and self:
-                job.status = JobStatus.PENDING
-                db.commit()
-                # Retry with exponential backoff
-                raise self.retry(exc=e, countdown=2 ** job.retry_count)
-            else:
-                job.completed_at = datetime.utcnow()
-                db.commit()
+            retrying = bool(self) and retry_count < job.max_retries
+            values = {
+                "status": JobStatus.PENDING if retrying else JobStatus.FAILED,
+                "error_message": str(e),
+                "retry_count": retry_count,
+            }
+            if not retrying:
+                values["completed_at"] = datetime.utcnow()
+                values["response_json"] = job_response_json(job, **values)
+
+            moved = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == committed_status)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+            if moved:
+                stats_counters.record_transition(committed_status, values["status"])
+                if retrying:
+                    # Retry with exponential backoff
+                    raise self.retry(exc=e, countdown=2 ** retry_count)
 
         raise e
 
     finally:
         db.close()
 
+BATCH_PROVIDERS = (AIProviderEnum.OPENAI_GPT4, AIProviderEnum.OPENAI_GPT35, AIProviderEnum.ANTHROPIC_CLAUDE)
+# OpenAI and Anthropic statuses that still have results to come
+BATCH_PENDING_STATUSES = ("validating", "in_progress", "finalizing", "cancelling", "canceling")
+BATCH_SUBMIT_RETRIES = 4
+# Consecutive failed status reads before a batch's jobs are failed
+BATCH_MAX_FETCH_ERRORS = 8
+
+def _fail_jobs(db, job_ids, message: str) -> list:
+    """Mark jobs failed; returns their status transitions to record after commit"""
+    transitions = []
+    for job in db.query(Job).filter(Job.id.in_(job_ids)).all():
+        transitions.append((job.status, JobStatus.FAILED))
+        job.status = JobStatus.FAILED
+        job.error_message = message
+        job.completed_at = datetime.utcnow()
+        job.response_json = job_response_json(job)
+    return transitions
+
+@celery_app.task(bind=True, max_retries=BATCH_SUBMIT_RETRIES)
+def submit_batch_jobs(self, job_ids: list):
+    """Summarize pending jobs through the provider batch APIs at half price
+
+    Queued by POST /api/jobs/batch, which creates the jobs without dispatching
+    process_document. Jobs for providers without a batch API, and demo jobs,
+    are left untouched. Each provider's batch is submitted and committed on its
+    own, so a failure for one provider never orphans another's batch.
+    """
+
+    db = SessionLocal()
+    manager = get_manager()
+    try:
+        jobs = db.query(Job).options(joinedload(Job.document)).filter(
+            Job.id.in_(job_ids),
+            Job.status == JobStatus.PENDING,
+            Job.is_demo == False,
+            Job.ai_provider.in_(BATCH_PROVIDERS)
+        ).all()
+
+        submitted = {}
+        failed = 0
+        retry_error = None
+        final_attempt = self.request.retries >= self.max_retries
+        for provider_type in BATCH_PROVIDERS:
+            provider = manager.get_provider(provider_type)
+            provider_jobs = [job for job in jobs if job.ai_provider == provider_type]
+            if not provider or not provider_jobs:
+                continue
+
+            transitions = []
+            docs = []
+            for job in provider_jobs:
+                text, _ = _extract_document_text(job.document)
+                # submit_batch maps the same capped chunks
+                job.truncated = provider.map_chunks(text)[1]
+                # Entities come from the source text, so capture them while we have it
+                job.entities = provider.extract_entities(text)
+                docs.append((text, job.id))
+
+            batch_id = None
+            if docs:
+                try:
+                    batch_id = worker_loop.run(provider.submit_batch(docs))
+                except Exception as e:
+                    logger.warning("Batch submission to %s failed", provider_type.value, exc_info=True)
+                    if final_attempt:
+                        transitions += _fail_jobs(db, [job_id for _, job_id in docs], f"Batch submission failed: {e}")
+                    else:
+                        # Left PENDING for the retry below
+                        retry_error = e
+
+            started = 0
+            if batch_id:
+                # Conditional, so jobs cancelled meanwhile stay cancelled; poll_batch ignores them
+                started = db.execute(
+                    update(Job)
+                    .where(Job.id.in_([job_id for _, job_id in docs]), Job.status == JobStatus.PENDING)
+                    .values(status=JobStatus.PROCESSING, started_at=datetime.utcnow(), batch_id=batch_id)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+            db.commit()
+            stats_counters.record_transitions(transitions)
+            stats_counters.record_transition(JobStatus.PENDING, JobStatus.PROCESSING, started)
+            failed += len(transitions)
+
+            if batch_id:
+                poll_batch.apply_async(
+                    args=[batch_id, provider_type.value, [job_id for _, job_id in docs]],
+                    countdown=settings.batch_poll_interval
+                )
+                submitted[provider_type.value] = batch_id
+
+        if retry_error is not None:
+            # Only the providers that failed still have PENDING jobs to pick up
+            raise self.retry(exc=retry_error, countdown=settings.batch_poll_interval * 2 ** self.request.retries)
+
+        return {"batches": submitted, "failed": failed}
+
+    finally:
+        db.close()
+
+@celery_app.task(bind=True, max_retries=None)
+def poll_batch(self, batch_id: str, provider_value: str, job_ids: list, reduce_round: int = 0, fetch_errors: int = 0):
+    """Poll a Batch API job and store the results once it finishes
+
+    Chunked documents come back as partial summaries; those are submitted again,
+    re-chunked, until they fit REDUCE_TOKEN_BUDGET and get one final summary request.
+    """
+
+    provider_type = AIProviderEnum(provider_value)
+    manager = get_manager()
+    provider = manager.get_provider(provider_type)
+    if not provider:
+        raise ValueError(f"Provider {provider_value} is not configured")
+
+    try:
+        status, results = worker_loop.run(provider.fetch_batch(batch_id))
+    except Exception as e:
+        if fetch_errors + 1 < BATCH_MAX_FETCH_ERRORS:
+            # Reading a batch is idempotent; back off and poll again
+            logger.warning("Polling batch %s failed", batch_id, exc_info=True)
+            raise self.retry(
+                exc=e,
+                countdown=settings.batch_poll_interval * 2 ** fetch_errors,
+                args=[batch_id, provider_value, job_ids],
+                kwargs={"reduce_round": reduce_round, "fetch_errors": fetch_errors + 1}
+            )
+        status, results = f"unreadable ({e})", {}
+    if status in BATCH_PENDING_STATUSES:
+        raise self.retry(
+            countdown=settings.batch_poll_interval,
+            args=[batch_id, provider_value, job_ids],
+            kwargs={"reduce_round": reduce_round, "fetch_errors": 0}
+        )
+
+    db = SessionLocal()
+    try:
+        if status != "completed":
+            transitions = _fail_jobs(db, job_ids, f"Batch {batch_id} ended with status {status}")
+            db.commit()
+            stats_counters.record_transitions(transitions)
+            return {"batch_id": batch_id, "status": status}
+
+        to_reduce = []
+        to_rechunk = []
+        failed_ids = []
+        transitions = []
+        completed_providers = []
+        # Jobs cancelled while the batch was running are left alone; the row locks
+        # make a cancel arriving now wait and then find the job finished
+        jobs = db.query(Job).filter(Job.id.in_(job_ids), Job.status == JobStatus.PROCESSING).with_for_update().all()
+        for job in jobs:
+            if f"job-{job.id}" in results:
+                content, input_tokens, output_tokens = results[f"job-{job.id}"]
+                job.summary, job.key_points = provider.parse_response(content)
+                job.actual_tokens = (job.actual_tokens or 0) + input_tokens + output_tokens
+                job.actual_cost = (job.actual_cost or 0.0) + provider.estimate_batch_cost(input_tokens, output_tokens)
+                job.status = JobStatus.COMPLETED
+                job.completed_at = datetime.utcnow()
+                job.processing_time = (job.completed_at - job.started_at).total_seconds()
+                job.response_json = job_response_json(job)
+                transitions.append((JobStatus.PROCESSING, JobStatus.COMPLETED))
+                completed_providers.append(job.ai_provider)
+                continue
+
+            prefix = f"job-{job.id}-chunk-"
+            chunks = sorted(
+                (int(custom_id[len(prefix):]), value)
+                for custom_id, value in results.items()
+                if custom_id.startswith(prefix)
+            )
+            if not chunks or [i for i, _ in chunks] != list(range(len(chunks))):
+                failed_ids.append(job.id)
+                continue
+
+            input_tokens = sum(value[1] for _, value in chunks)
+            output_tokens = sum(value[2] for _, value in chunks)
+            job.actual_tokens = (job.actual_tokens or 0) + input_tokens + output_tokens
+            job.actual_cost = (job.actual_cost or 0.0) + provider.estimate_batch_cost(input_tokens, output_tokens)
+            combined = "\n\n".join(value[0] for _, value in chunks)
+            if provider.fits_reduce(combined) or reduce_round + 1 >= MAX_REDUCE_ROUNDS:
+                to_reduce.append((combined, job.id))
+            else:
+                to_rechunk.append((combined, job.id))
+
+        if failed_ids:
+            transitions += _fail_jobs(db, failed_ids, f"Batch {batch_id} returned no result")
+
+        reductions = []
+        for docs, final in ((to_reduce, True), (to_rechunk, False)):
+            if not docs:
+                continue
+            reduce_job_ids = [job_id for _, job_id in docs]
+            try:
+                reduce_id = worker_loop.run(provider.submit_batch(docs, final=final))
+            except Exception as e:
+                # Not retried: the partials are already paid for and another pass
+                # could submit a reduce batch twice
+                logger.warning("Reduce batch submission to %s failed", provider_value, exc_info=True)
+                transitions += _fail_jobs(db, reduce_job_ids, f"Batch submission failed: {e}")
+                continue
+            db.execute(
+                update(Job).where(Job.id.in_(reduce_job_ids)).values(batch_id=reduce_id)
+                .execution_options(synchronize_session=False)
+            )
+            reductions.append((reduce_id, reduce_job_ids))
+
+        db.commit()
+        stats_counters.record_transitions(transitions, completed_providers)
+        for reduce_id, reduce_job_ids in reductions:
+            poll_batch.apply_async(
+                args=[reduce_id, provider_value, reduce_job_ids, reduce_round + 1],
+                countdown=settings.batch_poll_interval
+            )
+        return {
+            "batch_id": batch_id,
+            "status": status,
+            "reducing": len(to_reduce) + len(to_rechunk),
+            "failed": len(failed_ids)
+        }
+
+    finally:
+        db.close()
+
 @celery_app.task
 def generate_demo_jobs(count: int = 5):
     """Generate demo jobs for testing"""
@@ -274,42 +679,52 @@ def generate_demo_jobs(count: int = 5):
         ]
 
         providers = list(AIProviderEnum)
-        job_ids = []
-
-        for i in range(count):
-            # Create demo document
-            doc = Document(
-                filename=f"demo_doc_{i}.pdf",
-                original_filename=f"Demo Document {i}.pdf",
-                document_type="pdf",
-                file_size=random.randint(10000, 1000000),
-                file_path=f"/demo/doc_{i}.pdf",
-                doc_metadata={"demo": True, "text": random.choice(demo_texts)}
-            )
-            db.add(doc)
-            db.flush()
-
-            # Create demo job
-            job = Job(
-                document_id=doc.id,
-                status=JobStatus.PENDING,
-                ai_provider=random.choice(providers),
-                fallback_provider=random.choice(providers),
-                estimated_tokens=random.randint(1000, 5000),
-                estimated_cost=random.uniform(0.01, 0.50),
-                is_demo=True,
-                demo_delay=random.uniform(2, 10)
-            )
-            db.add(job)
-            db.flush()
-            job_ids.append(job.id)
+
+        # Draw each random column in one call
+        texts = random.choices(demo_texts, k=count)
+        primary_providers = random.choices(providers, k=count)
+        fallback_providers = random.choices(providers, k=count)
+
+        # One multi-row INSERT per table, with RETURNING, instead of a flush per row
+        document_ids = db.scalars(
+            insert(Document).returning(Document.id, sort_by_parameter_order=True),
+            [
+                {
+                    "filename": f"demo_doc_{i}.pdf",
+                    "original_filename": f"Demo Document {i}.pdf",
+                    "document_type": DocumentType.PDF,
+                    "file_size": random.randint(10000, 1000000),
+                    "file_path": f"/demo/doc_{i}.pdf",
+                    "doc_metadata": {"demo": True, "text": text}
+                }
+                for i, text in enumerate(texts)
+            ]
+        ).all()
+
+        job_ids = db.scalars(
+            insert(Job).returning(Job.id, sort_by_parameter_order=True),
+            [
+                {
+                    "document_id": document_id,
+                    "status": JobStatus.PENDING,
+                    "ai_provider": primary,
+                    "fallback_provider": fallback,
+                    "estimated_tokens": random.randint(1000, 5000),
+                    "estimated_cost": random.uniform(0.01, 0.50),
+                    "is_demo": True,
+                    "demo_delay": random.uniform(2, 10)
+                }
+                for document_id, primary, fallback in zip(document_ids, primary_providers, fallback_providers)
+            ]
+        ).all()
 
         # Commit all jobs to DB first
         db.commit()
+        stats_counters.record_transition(None, JobStatus.PENDING, len(job_ids))
 
-        # Then queue tasks after jobs are persisted
-        for job_id in job_ids:
-            process_document.delay(job_id)
+        # Then queue tasks after jobs are persisted, in one group publish on the
+        # demo queue; its own rate-limited worker keeps them away from user jobs
+        group(process_document.s(job_id) for job_id in job_ids).apply_async(queue='demo')
 
         return {"created": count, "status": "demo jobs queued"}
 
@@ -324,76 +739,145 @@ def cleanup_old_jobs(days: int = 30):
     try:
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         
-        # Delete old jobs
-        deleted = db.query(Job).filter(
-            Job.completed_at < cutoff_date,
-            Job.status.in_([JobStatus.COMPLETED, JobStatus.FAILED])
-        ).delete()
+        # Delete old jobs in bounded batches, committing each so row locks are
+        # held briefly; per status so the status counters can follow
+        deleted_by_status = {}
+        for status in (JobStatus.COMPLETED, JobStatus.FAILED):
+            deleted_by_status[status] = 0
+            while True:
+                batch = select(Job.id).where(
+                    Job.completed_at < cutoff_date,
+                    Job.status == status
+                ).limit(CLEANUP_BATCH_SIZE)
+                count = db.execute(
+                    delete(Job).where(Job.id.in_(batch)).execution_options(synchronize_session=False)
+                ).rowcount
+                db.commit()
+                stats_counters.record_transition(status, None, count)
+                deleted_by_status[status] += count
+                if count < CLEANUP_BATCH_SIZE:
+                    break
+        deleted = sum(deleted_by_status.values())
         
-        db.commit()
         return {"deleted_jobs": deleted}
         
     finally:
         db.close()
 
+def aggregate_system_stats(db) -> Tuple[dict, Dict[JobStatus, int]]:
+    """System stats straight from the tables in two queries, plus the raw status counts"""
+    from sqlalchemy import func
+    
+    # Every jobs aggregate in one round trip: per (status, provider) group the
+    # row count, the cost total, and the completed-job time total and count
+    completed = Job.status == JobStatus.COMPLETED
+    job_groups = db.query(
+        Job.status,
+        Job.ai_provider,
+        func.count(),
+        func.sum(Job.actual_cost),
+        func.sum(Job.processing_time).filter(completed),
+        func.count(Job.processing_time).filter(completed)
+    ).group_by(Job.status, Job.ai_provider)
+    
+    status_counts = {}
+    provider_usage = {provider.value: 0 for provider in AIProviderEnum}
+    total_cost = completed_time = completed_timed = 0
+    for status, provider, count, cost, time_sum, time_count in job_groups:
+        status_counts[status] = status_counts.get(status, 0) + count
+        if provider and status == JobStatus.COMPLETED:
+            provider_usage[provider.value] += count
+        total_cost += cost or 0.0
+        completed_time += time_sum or 0.0
+        completed_timed += time_count
+    
+    # Document types; their counts also give the document total
+    doc_types = {}
+    for doc_type, count in db.query(Document.document_type, func.count()).group_by(Document.document_type):
+        doc_types[doc_type.value if doc_type else "unknown"] = count
+    
+    payload = {
+        "total_jobs": sum(status_counts.values()),
+        "pending_jobs": status_counts.get(JobStatus.PENDING, 0),
+        "processing_jobs": status_counts.get(JobStatus.PROCESSING, 0),
+        "completed_jobs": status_counts.get(JobStatus.COMPLETED, 0),
+        "failed_jobs": status_counts.get(JobStatus.FAILED, 0),
+        "total_documents": sum(doc_types.values()),
+        "total_cost": total_cost,
+        "avg_processing_time": completed_time / completed_timed if completed_timed else 0.0,
+        "provider_usage": provider_usage,
+        "document_types": doc_types
+    }
+    return payload, status_counts
+
+def _stats_payload(stats) -> dict:
+    return {
+        "total_jobs": stats.total_jobs,
+        "pending_jobs": stats.pending_jobs,
+        "processing_jobs": stats.processing_jobs,
+        "completed_jobs": stats.completed_jobs,
+        "failed_jobs": stats.failed_jobs,
+        "total_documents": stats.total_documents,
+        "total_cost": stats.total_cost,
+        "avg_processing_time": stats.avg_processing_time,
+        "provider_usage": stats.provider_usage,
+        "document_types": stats.document_types
+    }
+
+def _publish_stats(payload: dict):
+    """Publish the snapshot so /api/stats can serve it without touching the DB"""
+    client = stats_counters.get_client()
+    if client is None:
+        return
+    try:
+        client.set(STATS_CACHE_KEY, json.dumps(payload), ex=settings.stats_cache_ttl)
+    except RedisError:
+        logger.warning("Stats cache write failed", exc_info=True)
+
+def _stats_summary(payload: dict) -> dict:
+    return {
+        "total_jobs": payload["total_jobs"],
+        "pending": payload["pending_jobs"],
+        "processing": payload["processing_jobs"],
+        "completed": payload["completed_jobs"],
+        "failed": payload["failed_jobs"]
+    }
+
 @celery_app.task
 def calculate_system_stats():
     """Calculate and store system statistics"""
     
     db = SessionLocal()
     try:
-        from sqlalchemy import func
         from .models import SystemStats
         
-        # Calculate stats
-        total_jobs = db.query(Job).count()
-        pending_jobs = db.query(Job).filter(Job.status == JobStatus.PENDING).count()
-        processing_jobs = db.query(Job).filter(Job.status == JobStatus.PROCESSING).count()
-        completed_jobs = db.query(Job).filter(Job.status == JobStatus.COMPLETED).count()
-        failed_jobs = db.query(Job).filter(Job.status == JobStatus.FAILED).count()
+        # A snapshot computed moments ago (e.g. by a concurrent cache-miss trigger)
+        # is republished instead of re-aggregating the tables
+        latest = db.query(SystemStats).order_by(SystemStats.id.desc()).first()
+        if latest and latest.timestamp and latest.timestamp > datetime.utcnow() - timedelta(seconds=settings.stats_min_interval):
+            # The counters still get resynced, from one cheap GROUP BY
+            from sqlalchemy import func
+            status_counts = {}
+            provider_counts = {}
+            for status, provider, count in db.query(Job.status, Job.ai_provider, func.count()).group_by(Job.status, Job.ai_provider):
+                status_counts[status] = status_counts.get(status, 0) + count
+                if provider and status == JobStatus.COMPLETED:
+                    provider_counts[provider.value] = count
+            stats_counters.reset_status_counts(status_counts, provider_counts)
+            payload = _stats_payload(latest)
+            _publish_stats(payload)
+            return _stats_summary(payload)
         
-        total_documents = db.query(Document).count()
-        total_cost = db.query(func.sum(Job.actual_cost)).scalar() or 0.0
+        payload, status_counts = aggregate_system_stats(db)
         
-        avg_time = db.query(func.avg(Job.processing_time)).filter(
-            Job.status == JobStatus.COMPLETED
-        ).scalar() or 0.0
+        # Resync the live counters so any drift lasts at most one run
+        stats_counters.reset_status_counts(status_counts, payload["provider_usage"])
         
-        # Provider usage
-        provider_usage = {}
-        for provider in AIProviderEnum:
-            count = db.query(Job).filter(Job.ai_provider == provider).count()
-            provider_usage[provider.value] = count
-        
-        # Document types
-        doc_types = {}
-        for doc_type in db.query(Document.document_type, func.count()).group_by(Document.document_type):
-            doc_types[doc_type[0].value if doc_type[0] else "unknown"] = doc_type[1]
-        
-        # Create stats entry
-        stats = SystemStats(
-            total_jobs=total_jobs,
-            pending_jobs=pending_jobs,
-            processing_jobs=processing_jobs,
-            completed_jobs=completed_jobs,
-            failed_jobs=failed_jobs,
-            total_documents=total_documents,
-            total_cost=total_cost,
-            avg_processing_time=avg_time,
-            provider_usage=provider_usage,
-            document_types=doc_types
-        )
-        
-        db.add(stats)
+        db.add(SystemStats(**payload))
         db.commit()
         
-        return {
-            "total_jobs": total_jobs,
-            "pending": pending_jobs,
-            "processing": processing_jobs,
-            "completed": completed_jobs,
-            "failed": failed_jobs
-        }
+        _publish_stats(payload)
+        return _stats_summary(payload)
         
     finally:
         db.close()
\ No newline at end of file
@@ -0,0 +1,45 @@
+import asyncio
+import concurrent.futures
+import threading
+import uvloop
+from celery.signals import worker_process_init
+from gevent import monkey
+
+_loop = None
+_lock = threading.Lock()
+
+def _new_loop() -> asyncio.AbstractEventLoop:
+    # uvloop waits in libuv, which the gevent hub can't see, so it would stall every
+    # green thread; the stdlib loop selects through gevent's patched selectors instead
+    if monkey.is_module_patched("socket"):
+        return asyncio.new_event_loop()
+    return uvloop.new_event_loop()
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    """Event loop shared by every task in this worker process
+
+    The loop runs forever in its own thread (a greenlet under -P gevent), so
+    concurrent tasks can submit coroutines to it without each building and
+    tearing down a loop of their own.
+    """
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            loop = _new_loop()
+            threading.Thread(target=loop.run_forever, name="worker-event-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+def submit(coro) -> concurrent.futures.Future:
+    """Start a coroutine on the worker loop without waiting for it"""
+    return asyncio.run_coroutine_threadsafe(coro, get_worker_loop())
+
+def run(coro):
+    """Run a coroutine on the worker loop and block the calling task until it finishes"""
+    return submit(coro).result()
+
+@worker_process_init.connect
+def _reset_after_fork(**kwargs):
+    # A prefork child inherits the parent's loop object but not its thread
+    global _loop
+    _loop = None
\ No newline at end of file
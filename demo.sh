@@ -24,14 +24,24 @@ else
     sleep 3
 fi
 
-# Check if Celery worker is running
-if pgrep -f "celery.*worker" > /dev/null ; then
+# Check if Celery workers are running (default queue and demo queue, each on its own)
+if pgrep -f "celery.*worker.*-Q celery " > /dev/null ; then
     echo "✅ Celery worker is running"
 else
     echo "⚠️  Starting Celery worker..."
     cd /Users/dustinbailey/Projects/cx/ai-doc-summary/backend
     source venv/bin/activate
-    celery -A app.celery_app worker --loglevel=info &
+    celery -A app.celery_app worker -P gevent -c 100 -Ofair -Q celery --loglevel=info &
+    sleep 3
+fi
+
+if pgrep -f "celery.*worker.*-Q demo " > /dev/null ; then
+    echo "✅ Celery demo worker is running"
+else
+    echo "⚠️  Starting Celery demo worker..."
+    cd /Users/dustinbailey/Projects/cx/ai-doc-summary/backend
+    source venv/bin/activate
+    PROCESS_DOCUMENT_RATE_LIMIT=12/s DB_POOL_SIZE=10 celery -A app.celery_app worker -P gevent -c 10 -Ofair -Q demo -n demo@%h --loglevel=info &
     sleep 3
 fi
 
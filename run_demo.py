@@ -3,14 +3,20 @@
 Simple demo runner for AI Document Summary System
 """
 import subprocess
+import shutil
 import sys
 import time
 import os
 import signal
 
 def run_command(cmd, cwd=None):
-    """Run a command and return the process"""
-    return subprocess.Popen(cmd, shell=True, cwd=cwd)
+    """Run a command directly (no shell) in its own process group and return the process"""
+    return subprocess.Popen(cmd, cwd=cwd, start_new_session=True)
+
+def venv_python(backend_dir):
+    """The backend venv's interpreter, so nothing needs to source activate"""
+    python_bin = os.path.abspath(os.path.join(backend_dir, "venv", "bin", "python"))
+    return python_bin if os.path.exists(python_bin) else sys.executable
 
 def main():
     print("🚀 Starting AI Document Summary Demo Mode...")
@@ -22,18 +28,20 @@ def main():
         # Change to backend directory
         backend_dir = "backend"
         frontend_dir = "frontend"
+        python_bin = venv_python(backend_dir)
         
         # Initialize database
         print("📊 Initializing database...")
         subprocess.run(
-            "source venv/bin/activate && python -c 'from app.database import init_db; init_db()'",
-            shell=True, cwd=backend_dir
+            [python_bin, "-c", "from app.database import init_db; init_db()"],
+            cwd=backend_dir
         )
         
         # Start backend
         print("🔧 Starting Backend Server...")
         backend_process = run_command(
-            "source venv/bin/activate && uvicorn app.main:app --host 0.0.0.0 --port 8000",
+            [python_bin, "-m", "uvicorn", "app.main:app", "--host", "0.0.0.0", "--port", "8000",
+             "--loop", "uvloop", "--http", "httptools"],
             cwd=backend_dir
         )
         processes.append(backend_process)
@@ -44,7 +52,7 @@ def main():
         # Start frontend
         print("🎨 Starting Frontend...")
         frontend_process = run_command(
-            "npm run dev -- --host 0.0.0.0 --port 5173",
+            [shutil.which("npm") or "npm", "run", "dev", "--", "--host", "0.0.0.0", "--port", "5173"],
             cwd=frontend_dir
         )
         processes.append(frontend_process)
@@ -70,8 +78,12 @@ def main():
             
     except KeyboardInterrupt:
         print("\n\n🛑 Stopping services...")
+        # npm starts vite as a child; signal each whole process group
         for p in processes:
-            p.terminate()
+            try:
+                os.killpg(p.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
         print("✅ Demo stopped.")
         sys.exit(0)
 
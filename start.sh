@@ -68,14 +68,25 @@ else
 fi
 echo ""
 
+# Celery workers: uploads on the default queue, rate-limited demo jobs on "demo"
+start_celery_worker() {
+    nohup celery -A app.celery_app worker -P gevent -c 100 -Ofair -Q celery --loglevel=info > /tmp/celery.log 2>&1 &
+    CELERY_PID=$!
+}
+
+start_celery_demo_worker() {
+    PROCESS_DOCUMENT_RATE_LIMIT=12/s DB_POOL_SIZE=10 nohup celery -A app.celery_app worker -P gevent -c 10 -Ofair -Q demo -n demo@%h --loglevel=info > /tmp/celery-demo.log 2>&1 &
+    CELERY_DEMO_PID=$!
+}
+
 # Start Celery Worker
 echo -e "${YELLOW}3️⃣  Celery Worker (Job Processing)${NC}"
 if port_in_use 6379 || [ "$DEMO_MODE" = "true" ]; then
-    nohup celery -A app.celery_app worker --loglevel=info > /tmp/celery.log 2>&1 &
-    CELERY_PID=$!
+    start_celery_worker
+    start_celery_demo_worker
     sleep 3
     
-    if pgrep -f "celery.*worker" > /dev/null; then
+    if kill -0 $CELERY_PID 2>/dev/null && kill -0 $CELERY_DEMO_PID 2>/dev/null; then
         echo -e "${GREEN}   ✅ Celery worker started${NC}"
     else
         echo -e "${YELLOW}   ⚠️  Celery in eager mode (synchronous)${NC}"
@@ -167,11 +178,20 @@ while true; do
         sleep 3
     fi
     
-    if ! pgrep -f "celery.*worker" > /dev/null && port_in_use 6379; then
+    # Each worker is restarted on its own, so one dying doesn't duplicate the other
+    if [ -n "$CELERY_PID" ] && ! kill -0 $CELERY_PID 2>/dev/null && port_in_use 6379; then
         echo -e "${RED}⚠️  Celery stopped - restarting...${NC}"
         cd /Users/dustinbailey/Projects/cx/ai-doc-summary/backend
         source venv/bin/activate
-        nohup celery -A app.celery_app worker --loglevel=info > /tmp/celery.log 2>&1 &
+        start_celery_worker
+        sleep 3
+    fi
+    
+    if [ -n "$CELERY_DEMO_PID" ] && ! kill -0 $CELERY_DEMO_PID 2>/dev/null && port_in_use 6379; then
+        echo -e "${RED}⚠️  Celery demo worker stopped - restarting...${NC}"
+        cd /Users/dustinbailey/Projects/cx/ai-doc-summary/backend
+        source venv/bin/activate
+        start_celery_demo_worker
         sleep 3
     fi
 done
\ No newline at end of file
@@ -33,8 +33,10 @@ uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload &
 BACKEND_PID=$!
 
 # Start Celery worker in background
-celery -A app.celery_app worker --loglevel=info &
+celery -A app.celery_app worker -P gevent -c 100 -Ofair -Q celery --loglevel=info &
 CELERY_PID=$!
+PROCESS_DOCUMENT_RATE_LIMIT=12/s DB_POOL_SIZE=10 celery -A app.celery_app worker -P gevent -c 10 -Ofair -Q demo -n demo@%h --loglevel=info &
+CELERY_DEMO_PID=$!
 
 cd ..
 
@@ -77,6 +79,7 @@ cleanup() {
     echo -e "\n${YELLOW}Stopping services...${NC}"
     kill $BACKEND_PID 2>/dev/null
     kill $CELERY_PID 2>/dev/null
+    kill $CELERY_DEMO_PID 2>/dev/null
     kill $FRONTEND_PID 2>/dev/null
     redis-cli shutdown 2>/dev/null || true
     echo -e "${GREEN}Demo stopped.${NC}"